@@ -1,7 +1,374 @@
-from flask import Flask
+import time
+
+
+def _process_start():
+    """perf_counter() reading when this process started (for a gunicorn
+    worker, when it was forked), to /proc's 10 ms resolution; import
+    time where /proc isn't available."""
+    now = time.perf_counter()
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19])  # starttime, in ticks
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return now
+    import os
+    return now - max(0.0, uptime - started / os.sysconf("SC_CLK_TCK"))
+
+
+BOOT = _process_start()  # Taken before any heavy import
+
+import atexit
+import fcntl
+import os
+import signal
+import struct
+import tempfile
+import threading
+
+from flask import Flask, g, has_request_context, jsonify, request
 
 app = Flask(__name__)
 
+# NANO_SYNC_SHARDS=0 keeps the original single-process behaviour
+SYNC_SHARDS = int(os.environ.get("NANO_SYNC_SHARDS", os.cpu_count() or 1))
+# Name of the shared device registry every worker process attaches to
+SHARD_PREFIX = os.environ.get("NANO_SHARD_PREFIX", "nano-devices")
+# Policy set every worker enforces; a push to any worker updates it
+POLICY_SET_PATH = os.environ.get(
+    "NANO_POLICY_SET", os.path.join(tempfile.gettempdir(), f"{SHARD_PREFIX}-policies"))
+# Snapshot of compiled policies and the device registry reused across restarts
+WARM_STATE_PATH = os.environ.get("NANO_WARM_STATE", "")
+# Seconds between snapshot saves, so a SIGKILL or OOM kill loses at most this much
+WARM_STATE_INTERVAL = float(os.environ.get("NANO_WARM_STATE_INTERVAL", 60))
+
+# Subsystems are imported and built on first use so a restarted worker
+# can take traffic as soon as Flask is up; concurrent first requests
+# build each one once, under _init_lock
+dispatcher = None
+policies = None
+warm = None
+_init_lock = threading.RLock()
+_save_lock = threading.Lock()
+_writer_lock = None         # flock held while this process writes the snapshot
+_saver = None
+_stopping = threading.Event()
+_shut_down = False
+metrics = {
+    "boot_ms": None,                    # Process start until apps.py is ready to serve
+    "first_request_ms": None,           # The first request that used a subsystem
+    "time_to_first_response_ms": None,  # The two together
+    "init_ms": {},                      # Each lazy subsystem's build time
+}
+
+
+def _using_subsystems():
+    if has_request_context():
+        g.uses_subsystems = True
+
+
+def _record_init(name, started):
+    metrics["init_ms"][name] = round((time.perf_counter() - started) * 1000, 3)
+
+
+def get_warm_state():
+    global warm
+    if warm is None and WARM_STATE_PATH:
+        with _init_lock:
+            if warm is None:
+                started = time.perf_counter()
+                from warm_state import WarmState
+                warm = WarmState.open(WARM_STATE_PATH) or False
+                _record_init("warm_state", started)
+    return warm or None
+
+
+def warm_section(tag):
+    state = get_warm_state()
+    return state.section(tag) if state else None
+
+
+def get_dispatcher():
+    global dispatcher
+    _using_subsystems()
+    if dispatcher is None:
+        with _init_lock:
+            if dispatcher is None:
+                started = time.perf_counter()
+                dispatcher = _open_dispatcher()
+                _record_init("dispatcher", started)
+    return dispatcher
+
+
+def _open_dispatcher():
+    from device_shards import RECORD, ShardDispatcher
+    from warm_state import DEVICES
+    saved = warm_section(DEVICES)
+    if saved is not None and len(saved) % RECORD.size:
+        app.logger.warning("ignoring truncated warm device registry")
+        saved = None
+    return ShardDispatcher.open(SHARD_PREFIX, SYNC_SHARDS, warm_records=saved)
+
+
+def get_policies():
+    global policies
+    _using_subsystems()
+    if policies is None:
+        with _init_lock:
+            if policies is None:
+                started = time.perf_counter()
+                policies = _restore_policies()
+                _record_init("policies", started)
+    return policies
+
+
+def _restore_policies():
+    import policy_binary
+    from shared_policies import SharedPolicyStore
+    from warm_state import POLICIES
+    store = SharedPolicyStore(POLICY_SET_PATH)
+    saved = warm_section(POLICIES)
+    if saved is not None:
+        # A bad snapshot must never block boot; fall back to a cold start.
+        # Only the first worker seeds; the rest find the published set
+        try:
+            compiled = [policy_binary.compile_policy(p) for p in policy_binary.PolicyBundle(saved)]
+            store.seed(compiled)
+        except (ValueError, IndexError, struct.error) as exc:
+            app.logger.warning("ignoring warm policy snapshot: %s", exc)
+    return store
+
+
+def save_warm_state():
+    """Write the warm snapshot; returns False if another worker owns it."""
+    with _save_lock:
+        if not _own_snapshot():
+            return False
+        _write_warm_state()
+        return True
+
+
+def _own_snapshot():
+    # One writer per snapshot: the first worker to take the lock keeps it
+    # for life, and another takes over only once that worker is gone
+    global _writer_lock
+    if _writer_lock is None:
+        lock_file = open(WARM_STATE_PATH + ".lock", "a+b")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        _writer_lock = lock_file
+    return True
+
+
+def _write_warm_state():
+    import warm_state
+    sections = {}
+    try:
+        bundle = _published_policies()
+    except (ValueError, IndexError, struct.error) as exc:
+        app.logger.error("not saving unreadable policy set: %s", exc)
+        bundle = None
+    if bundle is not None:
+        sections[warm_state.POLICIES] = bundle
+    # Like policies, the registry is shared; attach if this process never has
+    shards = dispatcher
+    if shards is None and SYNC_SHARDS:
+        from device_shards import ShardDispatcher
+        shards = ShardDispatcher.attach(SHARD_PREFIX)
+    if shards is not None:
+        sections[warm_state.DEVICES] = shards.export_records()
+        if shards is not dispatcher:
+            shards.close()
+    # Anything not published yet keeps its previous snapshot
+    for tag in (warm_state.POLICIES, warm_state.DEVICES):
+        saved = warm_section(tag)
+        if tag not in sections and saved is not None:
+            sections[tag] = bytes(saved)
+    warm_state.save(WARM_STATE_PATH, sections)
+
+
+def _published_policies():
+    # Saved from the set every worker shares, not this process's copy.
+    # The built-in default is recreated by PolicyStore(); only pushed
+    # policies (including a replaced default) need saving
+    import policy_binary
+    from policy_store import DEFAULT_POLICY
+    from shared_policies import read_published
+    published = read_published(POLICY_SET_PATH)
+    if published is None:
+        return None
+    docs = [p.to_dict() for p in policy_binary.PolicyBundle(published[1])]
+    return policy_binary.encode_bundle([doc for doc in docs if doc != DEFAULT_POLICY])
+
+
+def _save_periodically():
+    while not _stopping.wait(WARM_STATE_INTERVAL):
+        try:
+            save_warm_state()
+        except Exception:
+            app.logger.exception("periodic warm-state save failed")
+
+
+@atexit.register
+def shutdown():
+    global _shut_down
+    with _init_lock:
+        if _shut_down:
+            return
+        _shut_down = True
+    _stopping.set()
+    if _saver is not None:
+        _saver.join(timeout=10)
+    try:
+        if WARM_STATE_PATH:
+            save_warm_state()
+    finally:
+        if dispatcher is not None:
+            dispatcher.close()
+
+
+def _install_sigterm_handler():
+    # atexit never runs when SIGTERM takes the default action
+    previous = signal.getsignal(signal.SIGTERM)
+    if previous is not signal.SIG_DFL and not callable(previous):
+        return
+
+    def on_sigterm(signum, frame):
+        if not callable(previous):
+            try:
+                shutdown()
+            finally:
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+            return
+        # The server's own handler (e.g. gunicorn's graceful exit) lets
+        # in-flight requests finish and atexit close the registry; save
+        # now in case the exit is cut short
+        try:
+            save_warm_state()
+        except Exception:
+            app.logger.exception("warm-state save on SIGTERM failed")
+        previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+@app.before_request
+def start_saver():
+    global _saver
+    if _saver is None and WARM_STATE_PATH and WARM_STATE_INTERVAL > 0:
+        with _init_lock:
+            if _saver is None:
+                _saver = threading.Thread(target=_save_periodically, name="warm-state", daemon=True)
+                _saver.start()
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_first_response(response):
+    # Boot until the app was ready to serve, plus the handling of the
+    # first request that needed a subsystem (building it, if nothing had
+    # yet); health checks before it and idle time between don't count
+    if metrics["time_to_first_response_ms"] is None and g.get("uses_subsystems"):
+        boot = (READY - BOOT) * 1000
+        first = (time.perf_counter() - g.request_start) * 1000
+        metrics.update(boot_ms=round(boot, 3), first_request_ms=round(first, 3),
+                       time_to_first_response_ms=round(boot + first, 3))
+        app.logger.info("time to first response: %.3f ms", metrics["time_to_first_response_ms"])
+    return response
+
+
+@app.get("/python/metrics")
+def get_metrics():
+    return jsonify(metrics), 200
+
+
 @app.post("/python/device-sync")
 def sync():
-    return "Python backend synced nano‑devices", 200
+    batch = request.get_json(silent=True)
+    if not SYNC_SHARDS or batch is None:
+        return "Python backend synced nano‑devices", 200
+    if isinstance(batch, dict):
+        batch = batch.get("devices", [batch])
+    if not isinstance(batch, list):
+        return jsonify(error="expected a device record or list of records"), 400
+    shards = get_dispatcher()
+    result = shards.dispatch(batch)
+    # Pin one snapshot for the whole batch so a concurrent policy push
+    # can't split it across two policy sets
+    snapshot = get_policies().snapshot
+    decisions = []
+    for record in batch:
+        state = isinstance(record, dict) and shards.lookup_or_none(record.get("device_id"))
+        if state:
+            decision = snapshot.evaluate(state["system_state"])
+            if decision["action"] != "allow":
+                decisions.append(dict(decision, device_id=state["device_id"]))
+    result["decisions"] = decisions
+    return jsonify(result), 200
+
+
+def _policy_update(body):
+    """(load, unload) from a JSON body; TypeError if it has neither shape."""
+    if not isinstance(body, dict):
+        raise TypeError()
+    if "policy_id" in body:
+        return [body], []
+    load, unload = body.get("load", []), body.get("unload", [])
+    if not isinstance(load, list) or not all(isinstance(doc, dict) for doc in load):
+        raise TypeError("load must be a list of policy objects")
+    if not isinstance(unload, list) or not all(isinstance(i, str) for i in unload):
+        raise TypeError("unload must be a list of policy ids")
+    return load, unload
+
+
+@app.post("/python/policies")
+def push_policies():
+    import policy_binary
+    from policy_store import PolicyError
+
+    usage = "expected a policy, {load, unload} or a policy bundle"
+    store = get_policies()
+    if request.mimetype == "application/octet-stream":
+        try:
+            bundle = policy_binary.PolicyBundle(request.get_data())
+            load, unload = [policy_binary.compile_policy(p) for p in bundle], []
+        except PolicyError as exc:
+            return jsonify(error=str(exc)), 409
+        except (ValueError, IndexError, struct.error) as exc:
+            return jsonify(error=f"bad policy bundle: {exc}"), 400
+    else:
+        try:
+            load, unload = _policy_update(request.get_json(silent=True))
+        except TypeError as exc:
+            return jsonify(error=str(exc) or usage), 400
+    # Malformed requests are 400; 409 is left for updates the store refuses
+    if not load and not unload:
+        return jsonify(error=usage), 400
+    try:
+        snapshot = store.update(load, unload)
+    except PolicyError as exc:
+        return jsonify(error=str(exc)), 409
+    return jsonify(
+        snapshot_version=snapshot.version,
+        policies=[p.policy_id for p in snapshot.policies],
+        shadowed=["/".join(key) for key in snapshot.analysis.shadowed],
+        unsatisfiable=["/".join(key) for key in snapshot.analysis.unsatisfiable],
+        unknown_fields=[f"{p}/{r}: {field}" for p, r, field in snapshot.analysis.unknown_fields],
+        # Checks a rule was too large for; nothing was verified either way
+        skipped_checks=[f"{p}/{r}: {check}" for p, r, check in snapshot.analysis.skipped],
+    ), 200
+
+
+if WARM_STATE_PATH and threading.current_thread() is threading.main_thread():
+    _install_sigterm_handler()
+
+READY = time.perf_counter()  # Everything above is what a worker pays before serving
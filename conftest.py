@@ -0,0 +1,36 @@
+import json
+import os
+
+import pytest
+
+EXAMPLE_POLICY = os.path.join(
+    os.path.dirname(__file__), "POLICY SCHEMA DEFINITIONS", "schemas", "example_policy.json")
+
+# Well-formed stand-in; the example file ships a placeholder signature
+SIGNATURE = {"algorithm": "dilithium2", "value": "ab" * 32, "public_key": "cd" * 16}
+
+
+@pytest.fixture
+def example_policy():
+    with open(EXAMPLE_POLICY) as f:
+        f.readline()  # The file starts with its own path
+        doc = json.load(f)
+    doc["signature"] = dict(SIGNATURE)
+    return doc
+
+
+@pytest.fixture
+def make_policy():
+    """Build a signed policy document from (condition, action) pairs."""
+    def make(policy_id, rules, enforcement=("runtime",), version="1.0.0"):
+        return {
+            "policy_id": policy_id,
+            "version": version,
+            "rules": [
+                {"id": f"R-{i:03d}", "condition": condition, "action": action}
+                for i, (condition, action) in enumerate(rules)
+            ],
+            "enforcement": list(enforcement),
+            "signature": dict(SIGNATURE),
+        }
+    return make
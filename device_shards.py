@@ -0,0 +1,415 @@
+"""
+Sharded device registry
+Devices are partitioned by id hash into shards. Each shard is a named
+multiprocessing.shared_memory segment: the first process to open the
+registry creates the segments and every other front-end worker (e.g.
+each gunicorn worker) attaches to the same ones, so device state is the
+same whichever worker serves a request. Workers apply their own sync
+batches straight into shared memory; writers to one shard serialize on
+a per-shard flock, readers never lock.
+"""
+
+import fcntl
+import hashlib
+import logging
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+import weakref
+import zlib
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+from policy_conditions import SYSTEM_STATE_FIELDS
+
+DEVICE_ID_SIZE = 8           # Matches nano_packet.source[8]
+DEFAULT_CAPACITY = 4096      # Device slots per shard
+DEFAULT_PREFIX = "nano-devices"
+READ_RETRIES = 1000          # Seqlock retries before a read gives up
+
+# seq, device_id, trust, last_seen, then the SYSTEM_STATE_FIELDS in order
+RECORD = struct.Struct("<I8sBIHBBIHBI")
+
+# magic, record size, shard count, capacity; magic is written last
+META = struct.Struct("<4sHHI")
+META_MAGIC = b"NDS1"
+
+_EMPTY_ID = bytes(DEVICE_ID_SIZE)
+
+logger = logging.getLogger(__name__)
+
+
+class TornRecordError(RuntimeError):
+    """A record stayed mid-write for READ_RETRIES reads, e.g. because its
+    writer died; the next write to it repairs the sequence number."""
+
+
+def parse_device_id(device_id):
+    try:
+        raw = bytes.fromhex(device_id)
+    except (TypeError, ValueError):
+        raw = b""
+    if len(raw) != DEVICE_ID_SIZE or raw == _EMPTY_ID:
+        raise ValueError(f"invalid device_id: {device_id!r}")
+    return raw
+
+
+def shard_of(raw_id, shard_count):
+    return zlib.crc32(raw_id) % shard_count
+
+
+def _slot_hash(raw_id):
+    # Independent of shard_of() so shards don't cluster into the same slots
+    return int.from_bytes(hashlib.blake2b(raw_id, digest_size=4).digest(), "little")
+
+
+def _lock_path(name):
+    return os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+
+def _segment(name, create=False, size=0):
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    # Segments outlive any one worker; keep this process's resource
+    # tracker from unlinking them when it exits
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _unlink(shm):
+    # SharedMemory.unlink() unregisters from the tracker; pair it
+    resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+    shm.close()
+
+
+class DeviceStateTable:
+    """Open-addressed device table over one shared memory segment.
+
+    Writers bump the record's sequence number to odd before writing and
+    back to even afterwards; readers retry until they see a stable even
+    sequence, so lookups never need a lock. Callers holding the shard's
+    write lock pass ``locked=True``: no write can be in flight then.
+    """
+
+    def __init__(self, name, capacity=DEFAULT_CAPACITY, create=False):
+        self.capacity = capacity
+        size = capacity * RECORD.size
+        self.shm = _segment(name, create=create, size=size)
+        if create:
+            self.shm.buf[:size] = bytes(size)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _probe(self, raw_id):
+        start = _slot_hash(raw_id) % self.capacity
+        for i in range(self.capacity):
+            yield (start + i) % self.capacity
+
+    def _find(self, raw_id, claim):
+        buf = self.shm.buf
+        for slot in self._probe(raw_id):
+            off = slot * RECORD.size
+            stored = bytes(buf[off + 4:off + 4 + DEVICE_ID_SIZE])
+            if stored == raw_id:
+                return slot
+            if stored == _EMPTY_ID:
+                return slot if claim else None
+        return None
+
+    def read(self, raw_id, locked=False):
+        slot = self._find(raw_id, claim=False)
+        if slot is None:
+            return None
+        off = slot * RECORD.size
+        for _ in range(READ_RETRIES):
+            record = RECORD.unpack_from(self.shm.buf, off)
+            if locked or (record[0] % 2 == 0 and RECORD.unpack_from(self.shm.buf, off)[0] == record[0]):
+                break
+        else:
+            raise TornRecordError(f"device {raw_id.hex()} is mid-write")
+        _, _, trust, last_seen, *state = record
+        return {
+            "device_id": raw_id.hex(),
+            "trust": trust,
+            "last_seen": last_seen,
+            "system_state": dict(zip((f for f, _ in SYSTEM_STATE_FIELDS), state)),
+        }
+
+    def write(self, raw_id, trust, last_seen, state):
+        slot = self._find(raw_id, claim=True)
+        if slot is None:
+            raise MemoryError("device table full")
+        off = slot * RECORD.size
+        buf = self.shm.buf
+        seq, stored, old_trust = RECORD.unpack_from(buf, off)[:3]
+        if trust is None:
+            trust = old_trust if stored == raw_id else 0
+        seq += seq % 2   # Left odd by a writer that died mid-write
+        struct.pack_into("<I", buf, off, (seq + 1) % 2**32)
+        RECORD.pack_into(buf, off, (seq + 1) % 2**32, raw_id, trust, last_seen, *state)
+        struct.pack_into("<I", buf, off, (seq + 2) % 2**32)
+
+    def records(self):
+        """Raw bytes of every occupied record (seq zeroed), for warm snapshots."""
+        buf = self.shm.buf
+        for slot in range(self.capacity):
+            off = slot * RECORD.size
+            raw_id = bytes(buf[off + 4:off + 4 + DEVICE_ID_SIZE])
+            if raw_id == _EMPTY_ID:
+                continue
+            try:
+                state = self.read(raw_id)
+            except TornRecordError:
+                continue
+            yield RECORD.pack(0, raw_id, state["trust"], state["last_seen"],
+                              *state["system_state"].values())
+
+    def clear(self):
+        self.shm.buf[:] = bytes(len(self.shm.buf))
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        resource_tracker.register(self.shm._name, "shared_memory")
+        self.shm.unlink()
+
+
+def check_record(record):
+    """Shape-check one sync record before it reaches a shard, so one bad
+    device can only fail itself."""
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+    raw_id = parse_device_id(record.get("device_id"))
+    state = record.get("system_state")
+    if state is None:
+        return raw_id
+    if not isinstance(state, dict):
+        raise ValueError("system_state must be an object")
+    for field, _ in SYSTEM_STATE_FIELDS:
+        value = state.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or (
+                isinstance(value, float) and not math.isfinite(value)):
+            raise ValueError(f"invalid state value: {value!r}")
+    return raw_id
+
+
+def _clamp(value, limit):
+    return max(0, min(int(value), limit))
+
+
+def _apply(table, record):
+    # Trust is assigned by attestation (set_trust), never by the device
+    # reporting on itself, so any "trust" in the record is ignored
+    raw_id = parse_device_id(record.get("device_id"))
+    previous = table.read(raw_id, locked=True)
+    old_state = previous["system_state"] if previous else {}
+    new_state = record.get("system_state") or {}
+    # Missing or null fields keep the device's previous value
+    state = []
+    for field, limit in SYSTEM_STATE_FIELDS:
+        value = new_state.get(field)
+        state.append(_clamp(old_state.get(field, 0) if value is None else value, limit))
+    table.write(raw_id, None, int(time.time()), state)
+
+
+class ShardDispatcher:
+    """Routes /python/device-sync batches to the shard owning each device.
+
+    Use ``ShardDispatcher.open()``: the process that creates the named
+    segments owns them (and seeds them from a warm snapshot); everyone
+    else attaches. Segments are never unlinked on close, so the registry
+    survives worker restarts; ``unlink()`` removes it explicitly.
+    """
+
+    def __init__(self, prefix, meta, tables, owner):
+        self.prefix = prefix
+        self.meta = meta
+        self.tables = tables
+        self.shard_count = len(tables)
+        self.capacity = tables[0].capacity
+        self.owner = owner
+        self._open_locks()
+        # Descriptors inherited over fork share the parent's flocks, and a
+        # thread lock may have been held by a thread that didn't survive
+        # the fork; the child gets its own of both before it runs anything
+        ref = weakref.WeakMethod(self._open_locks)
+        os.register_at_fork(after_in_child=lambda: ref() and ref()())
+
+    def _open_locks(self):
+        self._thread_locks = [threading.Lock() for _ in self.tables]
+        self._lock_files = [
+            open(_lock_path(f"{self.prefix}-{shard}"), "a+b") for shard in range(self.shard_count)
+        ]
+
+    @classmethod
+    def open(cls, prefix=DEFAULT_PREFIX, shard_count=None, capacity=DEFAULT_CAPACITY,
+             warm_records=None):
+        """Create the registry if it doesn't exist yet, else attach to it.
+
+        ``shard_count``, ``capacity`` and ``warm_records`` (bytes from
+        export_records()) only matter to the creating process; attachers
+        take the layout from the registry's meta segment. Creating and
+        attaching both hold an flock on ``<prefix>-init.lock``; the kernel
+        drops it if a creator dies, so an unpublished meta segment found
+        while holding it is stale and gets rebuilt instead of waited on.
+        """
+        with open(_lock_path(f"{prefix}-init"), "a+b") as init_lock:
+            fcntl.flock(init_lock, fcntl.LOCK_EX)
+            try:
+                meta = _segment(f"{prefix}-meta")
+            except FileNotFoundError:
+                pass
+            else:
+                if bytes(meta.buf[:4]) == META_MAGIC:
+                    return cls._attach(prefix, meta)
+                logger.warning("rebuilding device registry %r left unfinished by a dead creator", prefix)
+                _unlink(meta)
+            return cls._create(prefix, shard_count or os.cpu_count() or 1, capacity, warm_records)
+
+    @classmethod
+    def attach(cls, prefix=DEFAULT_PREFIX):
+        """Attach to an existing registry; None if none is published."""
+        with open(_lock_path(f"{prefix}-init"), "a+b") as init_lock:
+            fcntl.flock(init_lock, fcntl.LOCK_EX)
+            try:
+                meta = _segment(f"{prefix}-meta")
+            except FileNotFoundError:
+                return None
+            if bytes(meta.buf[:4]) != META_MAGIC:
+                meta.close()
+                return None
+            return cls._attach(prefix, meta)
+
+    @classmethod
+    def _create(cls, prefix, shard_count, capacity, warm_records):
+        meta = _segment(f"{prefix}-meta", create=True, size=META.size)
+        tables = []
+        try:
+            for shard in range(shard_count):
+                name = f"{prefix}-{shard}"
+                try:
+                    tables.append(DeviceStateTable(name, capacity, create=True))
+                except FileExistsError:
+                    # Left behind by a creator that died before publishing meta
+                    stale = DeviceStateTable(name, capacity)
+                    stale.unlink()
+                    stale.close()
+                    tables.append(DeviceStateTable(name, capacity, create=True))
+            if warm_records:
+                cls._restore(tables, warm_records)
+        except BaseException:
+            for table in tables:
+                table.unlink()
+                table.close()
+            _unlink(meta)
+            raise
+        dispatcher = cls(prefix, meta, tables, owner=True)
+        meta.buf[4:META.size] = META.pack(b"\0" * 4, RECORD.size, shard_count, capacity)[4:]
+        meta.buf[:4] = META_MAGIC
+        return dispatcher
+
+    @staticmethod
+    def _restore(tables, warm_records):
+        # Nobody can attach before meta is published, so this process is
+        # the only writer
+        try:
+            for (_, raw_id, trust, last_seen, *state) in RECORD.iter_unpack(warm_records):
+                tables[shard_of(raw_id, len(tables))].write(raw_id, trust, last_seen, state)
+        except MemoryError:
+            # e.g. a snapshot from a larger shard count; start cold rather
+            # than serve from a partial registry
+            logger.warning("warm device registry doesn't fit %d shards; starting cold", len(tables))
+            for table in tables:
+                table.clear()
+
+    @classmethod
+    def _attach(cls, prefix, meta):
+        _, record_size, shard_count, capacity = META.unpack_from(meta.buf)
+        if record_size != RECORD.size:
+            meta.close()
+            raise RuntimeError(f"device registry {prefix!r} has an incompatible record layout")
+        tables = [DeviceStateTable(f"{prefix}-{shard}", capacity) for shard in range(shard_count)]
+        return cls(prefix, meta, tables, owner=False)
+
+    @contextmanager
+    def _locked(self, shard):
+        # flock excludes other processes, the thread lock other threads
+        # sharing this process's lock file descriptor
+        with self._thread_locks[shard]:
+            fcntl.flock(self._lock_files[shard], fcntl.LOCK_EX)
+            try:
+                yield self.tables[shard]
+            finally:
+                fcntl.flock(self._lock_files[shard], fcntl.LOCK_UN)
+
+    def dispatch(self, records):
+        partitions = {}
+        errors = []
+        for record in records:
+            try:
+                raw_id = check_record(record)
+            except ValueError as exc:
+                device_id = record.get("device_id") if isinstance(record, dict) else None
+                errors.append({"device_id": device_id, "error": str(exc)})
+                continue
+            partitions.setdefault(shard_of(raw_id, self.shard_count), []).append(record)
+
+        synced = 0
+        for shard, part in sorted(partitions.items()):
+            with self._locked(shard) as table:
+                for record in part:
+                    try:
+                        _apply(table, record)
+                        synced += 1
+                    except (ValueError, TypeError, OverflowError, MemoryError) as exc:
+                        errors.append({"device_id": record.get("device_id"), "error": str(exc)})
+                    except Exception as exc:
+                        # Never let one record abort the rest of the batch
+                        errors.append({"device_id": record.get("device_id"),
+                                       "error": f"internal error: {exc.__class__.__name__}"})
+        return {"synced": synced, "errors": errors}
+
+    def set_trust(self, device_id, trust):
+        """Record an attestation result; only backend code calls this."""
+        raw_id = parse_device_id(device_id)
+        shard = shard_of(raw_id, self.shard_count)
+        with self._locked(shard) as table:
+            previous = table.read(raw_id, locked=True)
+            if previous is None:
+                raise KeyError(device_id)
+            table.write(raw_id, _clamp(trust, 0xFF), previous["last_seen"],
+                        list(previous["system_state"].values()))
+
+    def export_records(self):
+        return b"".join(record for table in self.tables for record in table.records())
+
+    def lookup(self, device_id):
+        raw_id = parse_device_id(device_id)
+        return self.tables[shard_of(raw_id, self.shard_count)].read(raw_id)
+
+    def lookup_or_none(self, device_id):
+        try:
+            return self.lookup(device_id)
+        except (ValueError, TornRecordError):
+            return None
+
+    def close(self):
+        for table in self.tables:
+            table.close()
+        self.meta.close()
+        for lock_file in self._lock_files:
+            lock_file.close()
+
+    def unlink(self):
+        for table in self.tables:
+            table.unlink()
+        resource_tracker.register(self.meta._name, "shared_memory")
+        self.meta.unlink()
@@ -0,0 +1,17 @@
+"""Multi-process serving for apps.py: ``gunicorn apps:app``.
+
+gunicorn reads this file from the working directory. One worker per
+device shard, so every shard has a process to write it while the others
+keep serving; all workers attach to the same shared device registry
+(see device_shards.py). NANO_WORKERS overrides the count.
+"""
+import os
+
+bind = os.environ.get("NANO_BIND", "127.0.0.1:8000")
+# NANO_SYNC_SHARDS=0 is the single-process mode: no registry to share
+workers = int(os.environ.get("NANO_WORKERS", 0)) or max(
+    int(os.environ.get("NANO_SYNC_SHARDS", os.cpu_count() or 1)), 1)
+# Workers import apps.py themselves, so each builds its subsystems after
+# the fork and a restarted worker comes back without reloading the master
+preload_app = False
+graceful_timeout = 30
@@ -0,0 +1,313 @@
+"""
+Policy conflict/redundancy analyzer
+Every rule condition compares a system_state field against literals, so
+each field splits into a handful of cells: missing (or of a type no rule
+compares it with), each literal, and the open intervals between
+consecutive literals. A comparison holds on a fixed set of one field's
+cells, so a rule is a union of boxes, one cell set per field.
+Intersecting and subtracting boxes finds conflicting, shadowed and dead
+rules at load time; those checks only count cells a device registry
+state can actually reach (see FieldCells.domain).
+Runtime enforcement never re-runs the rules per device: the decision
+table maps each field's cell to the comparisons that hold there, so a
+state's comparisons are one OR per field, and the outcome of each
+distinct set of comparisons is worked out once and memoized.
+"""
+
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+import policy_conditions
+
+MAX_TERMS = 256           # Boxes per rule condition before its checks are skipped
+MAX_BOXES = 4096          # Uncovered boxes tracked per rule by the shadowing check
+MAX_OUTCOMES = 1 << 16    # Memoized outcomes per decision table
+TERMINAL_ACTIONS = ("deny", "quarantine", "self_destruct")
+FIELD_LIMITS = dict(policy_conditions.SYSTEM_STATE_FIELDS)
+CHECKS = ("conflicts", "shadowed", "unsatisfiable")
+
+
+def _comparisons(node):
+    if node[0] == "cmp":
+        yield node
+    else:
+        for child in node[1:]:
+            yield from _comparisons(child)
+
+
+def _ordered_cell(literals, value):
+    # Cell 2i is the gap below literals[i], cell 2i + 1 the literal itself
+    i = bisect_left(literals, value)
+    return 2 * i + 1 if i < len(literals) and literals[i] == value else 2 * i
+
+
+@dataclass(frozen=True)
+class FieldCells:
+    """How one field's values map onto cell indices.
+
+    Cell 0 is a missing value, or one no comparison on the field can
+    match (a string where rules only compare integers, and vice versa).
+    String and integer literals then each add their points and the gaps
+    between them.
+    """
+    name: str
+    strings: Tuple[str, ...] = ()
+    numbers: Tuple[int, ...] = ()
+
+    @property
+    def _number_base(self):
+        return 1 + (2 * len(self.strings) + 1 if self.strings else 0)
+
+    @property
+    def size(self):
+        return self._number_base + (2 * len(self.numbers) + 1 if self.numbers else 0)
+
+    @property
+    def full(self):
+        return (1 << self.size) - 1
+
+    def classify(self, value):
+        if isinstance(value, str):
+            return 1 + _ordered_cell(self.strings, value) if self.strings else 0
+        if isinstance(value, (int, float)) and self.numbers:
+            return self._number_base + _ordered_cell(self.numbers, value)
+        return 0
+
+    def cells(self, op, literal):
+        """Bitmask of the cells where ``value <op> literal`` holds."""
+        if isinstance(literal, str):
+            base, literals = 1, self.strings
+        else:
+            base, literals = self._number_base, self.numbers
+        target = 2 * literals.index(literal) + 1
+        mask = 0
+        for k in range(2 * len(literals) + 1):
+            # Cells are ordered like the values in them, so comparing
+            # cell positions compares the values
+            if policy_conditions.compare(k, op, target):
+                mask |= 1 << (base + k)
+        return mask
+
+    def domain(self):
+        """Cells a registry state can fall into: integers within the
+        field's SYSTEM_STATE_FIELDS range, plus the CRYPTO_ALGORITHMS
+        names normalize_state() turns in-range crypto_algorithm codes
+        into. Fields outside system_state are always missing."""
+        limit = FIELD_LIMITS.get(self.name)
+        if limit is None:
+            return 1
+        mask, low = 0, 0
+        if self.name == "crypto_algorithm":
+            algorithms = policy_conditions.CRYPTO_ALGORITHMS
+            for name in algorithms:
+                mask |= 1 << self.classify(name)
+            low = len(algorithms)
+        cs = self.numbers
+        if not cs:
+            return mask | 1
+        base = self._number_base
+        for i in range(len(cs) + 1):
+            lo = low if i == 0 else max(low, cs[i - 1] + 1)
+            hi = limit if i == len(cs) else min(limit, cs[i] - 1)
+            if lo <= hi:
+                mask |= 1 << (base + 2 * i)
+            if i < len(cs) and low <= cs[i] <= limit:
+                mask |= 1 << (base + 2 * i + 1)
+        return mask
+
+
+def field_cells(rules):
+    literals = {}
+    for rule in rules:
+        for _, name, _, value in _comparisons(rule.ast):
+            literals.setdefault(name, set()).add(value)
+    return tuple(
+        FieldCells(
+            name,
+            strings=tuple(sorted(v for v in values if isinstance(v, str))),
+            numbers=tuple(sorted(v for v in values if not isinstance(v, str))),
+        )
+        for name, values in sorted(literals.items())
+    )
+
+
+def _intersect(a, b):
+    box = tuple(x & y for x, y in zip(a, b))
+    return box if all(box) else None
+
+
+def _subtract(box, cover):
+    """Disjoint boxes making up ``box`` minus ``cover``."""
+    if _intersect(box, cover) is None:
+        return [box]
+    pieces, rest = [], list(box)
+    for i, (b, c) in enumerate(zip(box, cover)):
+        if b & ~c:
+            pieces.append(tuple(rest[:i]) + (b & ~c,) + tuple(rest[i + 1:]))
+            rest[i] = b & c
+    return pieces
+
+
+def _boxes(node, fields, index):
+    """A condition as a union of boxes, or None past MAX_TERMS boxes."""
+    if node[0] == "cmp":
+        _, name, op, value = node
+        i = index[name]
+        return [tuple(fields[i].cells(op, value) if j == i else f.full for j, f in enumerate(fields))]
+    parts = []
+    for child in node[1:]:
+        part = _boxes(child, fields, index)
+        if part is None:
+            return None
+        parts.append(part)
+    if node[0] == "or":
+        boxes = list(dict.fromkeys(box for part in parts for box in part))
+        return boxes if len(boxes) <= MAX_TERMS else None
+    boxes = parts[0]
+    for part in parts[1:]:
+        product = {}
+        for a in boxes:
+            for b in part:
+                box = _intersect(a, b)
+                if box is not None:
+                    product[box] = None
+                    if len(product) > MAX_TERMS:
+                        return None
+        boxes = list(product)
+    return boxes
+
+
+def _holds(node, comparisons):
+    kind = node[0]
+    if kind == "cmp":
+        return comparisons >> node[1] & 1
+    if kind == "and":
+        return all(_holds(n, comparisons) for n in node[1:])
+    return any(_holds(n, comparisons) for n in node[1:])
+
+
+@dataclass(frozen=True)
+class DecisionTable:
+    fields: Tuple[FieldCells, ...]
+    masks: Tuple[Tuple[int, ...], ...]   # Per field and cell: bits of the comparisons holding there
+    rules: Tuple[tuple, ...]             # (condition over comparison bits, terminal, hit)
+    outcomes: dict = field(default_factory=dict, compare=False, repr=False)
+
+    def lookup(self, state):
+        """(decisive hit or None, logged hits) for a normalized state."""
+        comparisons = 0
+        for cells, masks in zip(self.fields, self.masks):
+            comparisons |= masks[cells.classify(state.get(cells.name))]
+        outcome = self.outcomes.get(comparisons)
+        if outcome is None:
+            outcome = self._decide(comparisons)
+            if len(self.outcomes) < MAX_OUTCOMES:
+                self.outcomes[comparisons] = outcome
+        return outcome
+
+    def _decide(self, comparisons):
+        logged = []
+        for condition, terminal, hit in self.rules:
+            if not _holds(condition, comparisons):
+                continue
+            if terminal:
+                return hit, tuple(logged)
+            logged.append(hit)
+        return None, tuple(logged)
+
+
+def _decision_table(keyed, fields, index):
+    bits = {}
+
+    def number(node):
+        if node[0] == "cmp":
+            return ("cmp", bits.setdefault(node[1:], len(bits)))
+        return (node[0],) + tuple(number(child) for child in node[1:])
+
+    rules = tuple((number(rule.ast), rule.action in TERMINAL_ACTIONS, hit) for _, rule, hit in keyed)
+    masks = [[0] * cells.size for cells in fields]
+    for (name, op, value), bit in bits.items():
+        i = index[name]
+        held = fields[i].cells(op, value)
+        for k in range(fields[i].size):
+            if held >> k & 1:
+                masks[i][k] |= 1 << bit
+    return DecisionTable(fields, tuple(map(tuple, masks)), rules)
+
+
+@dataclass(frozen=True)
+class Analysis:
+    conflicts: Tuple[tuple, ...] = ()       # (rule key, rule key) that contradict
+    shadowed: Tuple[tuple, ...] = ()        # Rules that never decide anything
+    unsatisfiable: Tuple[tuple, ...] = ()   # Rules no state can trigger
+    unknown_fields: Tuple[tuple, ...] = ()  # (policy_id, rule_id, field) not in system_state
+    skipped: Tuple[tuple, ...] = ()         # (policy_id, rule_id, check) too large to decide
+    table: Optional[DecisionTable] = None
+
+
+def _contradicts(rule_a, rule_b):
+    # allow vs deny/quarantine/self_destruct on overlapping states is a
+    # contradiction; terminal actions among themselves resolve by order
+    actions = {rule_a.action, rule_b.action}
+    return "allow" in actions and bool(actions & set(TERMINAL_ACTIONS))
+
+
+def analyze(policies):
+    """Analyze an ordered policy set as governance_enforce() would run it."""
+    keyed = [((p.policy_id, r.id), r, (p.policy_id, r.id, r.action, r.message))
+             for p in policies for r in p.rules]
+    unknown = tuple(dict.fromkeys(
+        key + (name,)
+        for key, rule, _ in keyed
+        for _, name, _, _ in _comparisons(rule.ast)
+        if name not in FIELD_LIMITS
+    ))
+    fields = field_cells([r for _, r, _ in keyed])
+    index = {cells.name: i for i, cells in enumerate(fields)}
+    domain = tuple(cells.domain() for cells in fields)
+
+    # Each rule's boxes, clipped to the states a registry can hold
+    reachable, skipped = {}, []
+    for key, rule, _ in keyed:
+        boxes = _boxes(rule.ast, fields, index)
+        if boxes is None:
+            skipped.extend(key + (check,) for check in CHECKS)
+        else:
+            reachable[key] = [box for box in (_intersect(b, domain) for b in boxes) if box]
+
+    conflicts = []
+    for i, (key_a, rule_a, _) in enumerate(keyed):
+        for key_b, rule_b, _ in keyed[i + 1:]:
+            if key_a in reachable and key_b in reachable and _contradicts(rule_a, rule_b) and any(
+                    _intersect(a, b) for a in reachable[key_a] for b in reachable[key_b]):
+                conflicts.append((key_a, key_b))
+
+    # A rule is shadowed when earlier terminal rules decide every state it matches
+    shadowed, decided, complete = [], [], True
+    for key, rule, _ in keyed:
+        remaining = reachable.get(key)
+        if remaining:
+            for cover in decided:
+                remaining = [piece for box in remaining for piece in _subtract(box, cover)]
+                if not remaining or len(remaining) > MAX_BOXES:
+                    break
+            if not remaining:
+                shadowed.append(key)
+            elif len(remaining) > MAX_BOXES or not complete:
+                # Some earlier rule's coverage is unknown; it may shadow this one
+                skipped.append(key + ("shadowed",))
+        if rule.action in TERMINAL_ACTIONS:
+            if key in reachable:
+                decided.extend(reachable[key])
+            else:
+                complete = False
+
+    return Analysis(
+        conflicts=tuple(conflicts),
+        shadowed=tuple(shadowed),
+        unsatisfiable=tuple(key for key, _, _ in keyed if reachable.get(key) == []),
+        unknown_fields=unknown,
+        skipped=tuple(skipped),
+        table=_decision_table(keyed, fields, index),
+    )
@@ -0,0 +1,472 @@
+"""
+Compact binary encoding for nano_policy documents
+Layout (little-endian, offsets relative to the start of the policy):
+  header | rule table (fixed-size entries) | signature | tokens | strings
+Conditions are stored pre-tokenized; ids, names, messages and literals
+live once in a string table. Anything without a compact form (unusual
+condition spacing, extra keys, non-canonical signatures) is kept as text
+so decode(encode(doc)) == doc for every policy. A condition kept as text
+has no tokens, and extra keys may never shadow a compact field, so each
+value has exactly one encoding to decode and compile from.
+
+Bundles concatenate policies behind an offset table and are opened with
+mmap; rules are only decoded when first touched, and compile_policy()
+builds a CompiledPolicy from the token streams without going back
+through JSON.
+
+This is a backend format only: no device-side decoder exists, and it
+does not map onto the C nano_policy struct (I64 literals, JSON extras
+and unbounded strings have no place in its fixed-size fields).
+"""
+
+import json
+import mmap
+import struct
+
+import policy_conditions
+import policy_store
+from policy_store import ACTIONS, ENFORCEMENT_POINTS, VERSION, PolicyError
+
+MAGIC = b"NPOL"
+BUNDLE_MAGIC = b"NPB1"
+FORMAT_VERSION = 1
+NONE = 0xFFFF
+
+# magic, format, flags, rule_count, enforcement mask, version x3,
+# policy_id, signature_off, tokens_off, strings_off, string_count, extra, total_len
+HEADER = struct.Struct("<4sBBBBHHHHHHHHHH")
+# id, action, message, condition override, tokens_off, tokens_len, extra
+RULE = struct.Struct("<HBHHHHH")
+BUNDLE_HEADER = struct.Struct("<4sH")
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+I64 = struct.Struct("<q")
+
+FLAG_VERSION = 0x01
+FLAG_ENFORCEMENT = 0x02
+FLAG_SIGNATURE = 0x04
+FLAG_COMPACT = FLAG_VERSION | FLAG_ENFORCEMENT | FLAG_SIGNATURE
+
+_TOP_KEYS = ("policy_id", "version", "rules", "enforcement", "signature")
+_RULE_KEYS = ("id", "condition", "action", "message")
+# Op tokens get codes 0..9; names, strings and ints follow
+_OPS = policy_conditions.OPERATORS + ("&&", "||", "(", ")")
+TOK_NAME, TOK_STR, TOK_INT = 0x10, 0x11, 0x12
+
+
+class PolicyFormatError(ValueError):
+    pass
+
+
+def _hex_bytes(value):
+    if not isinstance(value, str):
+        return None
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return None
+    return raw if raw.hex() == value and len(raw) < 256 else None
+
+
+def _json(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+class _Strings:
+    def __init__(self):
+        self.index = {}
+
+    def add(self, text):
+        if text is None:
+            return NONE
+        return self.index.setdefault(text, len(self.index))
+
+    def encode(self, base):
+        table = bytearray()
+        data = bytearray()
+        start = base + U16.size * len(self.index)
+        for text in self.index:
+            table += U16.pack(start + len(data))
+            raw = text.encode()
+            data += U16.pack(len(raw)) + raw
+        return bytes(table + data)
+
+
+def encode_policy(doc):
+    """Encode one policy document; raises PolicyFormatError if it can't be
+    represented (missing policy_id, malformed rules, too large)."""
+    if not isinstance(doc, dict) or not isinstance(doc.get("policy_id"), str):
+        raise PolicyFormatError("policy must be an object with a policy_id")
+    rules = doc.get("rules")
+    if not isinstance(rules, list) or len(rules) > 255:
+        raise PolicyFormatError("rules must be a list of at most 255 entries")
+
+    strings = _Strings()
+    extra = {k: v for k, v in doc.items() if k not in _TOP_KEYS}
+    flags = 0
+
+    version = (0, 0, 0)
+    match = VERSION.match(doc["version"]) if isinstance(doc.get("version"), str) else None
+    if match and all(int(p) <= NONE for p in match.groups()) \
+            and ".".join(str(int(p)) for p in match.groups()) == doc["version"]:
+        flags |= FLAG_VERSION
+        version = tuple(int(p) for p in match.groups())
+    elif "version" in doc:
+        extra["version"] = doc["version"]
+
+    enforcement = doc.get("enforcement")
+    mask = 0
+    if isinstance(enforcement, list) and \
+            enforcement == [p for p in ENFORCEMENT_POINTS if p in enforcement]:
+        flags |= FLAG_ENFORCEMENT
+        for point in enforcement:
+            mask |= 1 << ENFORCEMENT_POINTS.index(point)
+    elif "enforcement" in doc:
+        extra["enforcement"] = enforcement
+
+    signature = doc.get("signature")
+    sig_blob = b""
+    if isinstance(signature, dict) and set(signature) == {"algorithm", "value", "public_key"} \
+            and signature["algorithm"] == "dilithium2" \
+            and _hex_bytes(signature["value"]) is not None \
+            and _hex_bytes(signature["public_key"]) is not None:
+        flags |= FLAG_SIGNATURE
+        for part in (_hex_bytes(signature["value"]), _hex_bytes(signature["public_key"])):
+            sig_blob += bytes([len(part)]) + part
+    elif "signature" in doc:
+        extra["signature"] = signature
+
+    rule_entries = []
+    tokens = bytearray()
+    for rule in rules:
+        if not isinstance(rule, dict) or not isinstance(rule.get("id"), str) \
+                or not isinstance(rule.get("condition"), str) or rule.get("action") not in ACTIONS:
+            raise PolicyFormatError(f"{doc['policy_id']}: rules need id, condition and action")
+        message = rule.get("message")
+        rule_extra = {k: v for k, v in rule.items() if k not in _RULE_KEYS}
+        if "message" in rule and not isinstance(message, str):
+            rule_extra["message"], message = message, None
+        try:
+            stream = policy_conditions.tokenize(rule["condition"])
+        except policy_conditions.ConditionError:
+            stream = None
+        override = None
+        start = len(tokens)
+        if stream is None or policy_conditions.render(stream) != rule["condition"]:
+            override, stream = rule["condition"], ()
+        for kind, value in stream:
+            if kind == "op":
+                tokens.append(_OPS.index(value))
+            elif kind == "int":
+                if not -2**63 <= value < 2**63:
+                    raise PolicyFormatError(f"{doc['policy_id']}: integer literal out of range")
+                tokens += bytes([TOK_INT]) + I64.pack(value)
+            else:
+                tokens += bytes([TOK_NAME if kind == "name" else TOK_STR]) \
+                    + U16.pack(strings.add(value))
+        rule_entries.append((
+            strings.add(rule["id"]),
+            ACTIONS.index(rule["action"]),
+            strings.add(message),
+            strings.add(override),
+            start,
+            len(tokens) - start,
+            strings.add(_json(rule_extra)) if rule_extra else NONE,
+        ))
+
+    policy_id = strings.add(doc["policy_id"])
+    extra_idx = strings.add(_json(extra)) if extra else NONE
+
+    sig_off = HEADER.size + RULE.size * len(rule_entries)
+    tokens_off = sig_off + len(sig_blob)
+    strings_off = tokens_off + len(tokens)
+    total = strings_off + sum(U16.size * 2 + len(t.encode()) for t in strings.index)
+    if total > NONE or len(strings.index) >= NONE:
+        raise PolicyFormatError(f"{doc['policy_id']}: encoded policy exceeds 64KB")
+    string_blob = strings.encode(strings_off)
+
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, flags, len(rule_entries), mask, *version,
+        policy_id, sig_off if sig_blob else NONE, tokens_off, strings_off,
+        len(strings.index), extra_idx, total,
+    )
+    return header + b"".join(RULE.pack(*e) for e in rule_entries) + sig_blob \
+        + bytes(tokens) + string_blob
+
+
+class LazyRule:
+    """One rule; its token stream is only decoded when asked for."""
+
+    def __init__(self, policy, index):
+        self._policy = policy
+        (self._id, self._action, self._message, self._override,
+         self._tokens_off, self._tokens_len, self._extra) = RULE.unpack_from(
+            policy.buf, policy.offset + HEADER.size + RULE.size * index)
+        if self._action >= len(ACTIONS):
+            raise PolicyFormatError(f"bad action code {self._action}")
+        self._stream = None
+
+    @property
+    def id(self):
+        return self._policy.string(self._id)
+
+    @property
+    def action(self):
+        return ACTIONS[self._action]
+
+    @property
+    def tokens(self):
+        """Token stream, empty when the condition is kept as text."""
+        if self._stream is None:
+            self._stream = self._policy.decode_tokens(self._tokens_off, self._tokens_len)
+        return self._stream
+
+    @property
+    def message(self):
+        """Compact message, or None if it's absent or kept in extras."""
+        if self._message == NONE:
+            return None
+        return self._policy.string(self._message)
+
+    @property
+    def extras(self):
+        if self._extra == NONE:
+            return {}
+        reserved = _RULE_KEYS if self._message != NONE else _RULE_KEYS[:-1]
+        return self._policy.extra(self._extra, reserved)
+
+    @property
+    def condition(self):
+        if self._override != NONE:
+            return self._policy.string(self._override)
+        return policy_conditions.render(self.tokens)
+
+    @property
+    def ast(self):
+        if self._override != NONE:
+            return policy_conditions.parse(self.condition)
+        return policy_conditions.parse_tokens(self.tokens)
+
+    def to_dict(self):
+        out = {"id": self.id, "condition": self.condition, "action": self.action}
+        if self._message != NONE:
+            out["message"] = self.message
+        out.update(self.extras)
+        return out
+
+
+class LazyPolicy:
+    """Read-only view of one encoded policy inside a buffer."""
+
+    def __init__(self, buf, offset=0):
+        self.buf = buf
+        self.offset = offset
+        if len(buf) - offset < HEADER.size:
+            raise PolicyFormatError("truncated policy header")
+        (magic, fmt, self.flags, self.rule_count, self._mask, *version,
+         self._policy_id, self._sig_off, self._tokens_off, self._strings_off,
+         self._string_count, self._extra, self.size) = HEADER.unpack_from(buf, offset)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise PolicyFormatError("not an encoded nano_policy")
+        if bool(self.flags & FLAG_SIGNATURE) != (self._sig_off != NONE):
+            raise PolicyFormatError("signature flag and offset disagree")
+        rules_end = HEADER.size + RULE.size * self.rule_count
+        sig_off = rules_end if self._sig_off == NONE else self._sig_off
+        bounds = (rules_end, sig_off, self._tokens_off, self._strings_off,
+                  self._strings_off + U16.size * self._string_count, self.size, len(buf) - offset)
+        if list(bounds) != sorted(bounds):
+            raise PolicyFormatError("policy sections overlap or are truncated")
+        self.version = tuple(version)
+        self._rules = [None] * self.rule_count
+        self._strings = {}
+
+    def string(self, index):
+        text = self._strings.get(index)
+        if text is None:
+            if index >= self._string_count:
+                raise PolicyFormatError(f"string index {index} out of range")
+            pos = self.offset + U16.unpack_from(self.buf, self.offset + self._strings_off + 2 * index)[0]
+            length = U16.unpack_from(self.buf, pos)[0] if pos + 2 <= self.offset + self.size else NONE
+            if pos + 2 + length > self.offset + self.size:
+                raise PolicyFormatError(f"string {index} runs past the policy")
+            try:
+                text = bytes(self.buf[pos + 2:pos + 2 + length]).decode()
+            except UnicodeDecodeError:
+                raise PolicyFormatError(f"string {index} is not UTF-8") from None
+            self._strings[index] = text
+        return text
+
+    def decode_tokens(self, start, length):
+        pos = self.offset + self._tokens_off + start
+        end = pos + length
+        if end > self.offset + self._strings_off:
+            raise PolicyFormatError("token stream runs past the token section")
+        out = []
+        while pos < end:
+            code = self.buf[pos]
+            if code >= len(_OPS) and pos + (1 + I64.size if code == TOK_INT else 3) > end:
+                raise PolicyFormatError("truncated token")
+            if code < len(_OPS):
+                out.append(("op", _OPS[code]))
+                pos += 1
+            elif code == TOK_INT:
+                out.append(("int", I64.unpack_from(self.buf, pos + 1)[0]))
+                pos += 1 + I64.size
+            elif code in (TOK_NAME, TOK_STR):
+                value = self.string(U16.unpack_from(self.buf, pos + 1)[0])
+                out.append(("name" if code == TOK_NAME else "str", value))
+                pos += 3
+            else:
+                raise PolicyFormatError(f"bad token code {code:#x}")
+        return out
+
+    def extra(self, index, reserved):
+        """Decode a JSON object of keys that had no compact form; it may
+        not repeat any of the ``reserved`` keys stored compactly."""
+        try:
+            value = json.loads(self.string(index))
+        except ValueError:
+            value = None
+        if not isinstance(value, dict):
+            raise PolicyFormatError("extra fields must be a JSON object")
+        clash = sorted(set(value) & set(reserved))
+        if clash:
+            raise PolicyFormatError(f"extra fields repeat {', '.join(clash)}")
+        return value
+
+    @property
+    def policy_id(self):
+        return self.string(self._policy_id)
+
+    def rule(self, index):
+        if self._rules[index] is None:
+            self._rules[index] = LazyRule(self, index)
+        return self._rules[index]
+
+    @property
+    def rules(self):
+        return [self.rule(i) for i in range(self.rule_count)]
+
+    @property
+    def enforcement(self):
+        if not self.flags & FLAG_ENFORCEMENT:
+            return None
+        return [p for i, p in enumerate(ENFORCEMENT_POINTS) if self._mask >> i & 1]
+
+    @property
+    def signature(self):
+        if not self.flags & FLAG_SIGNATURE:
+            return None
+        pos = self.offset + self._sig_off
+        parts = []
+        for _ in range(2):
+            length = self.buf[pos]
+            if pos + 1 + length > self.offset + self._tokens_off:
+                raise PolicyFormatError("signature runs past its section")
+            parts.append(bytes(self.buf[pos + 1:pos + 1 + length]).hex())
+            pos += 1 + length
+        return {"algorithm": "dilithium2", "value": parts[0], "public_key": parts[1]}
+
+    @property
+    def extras(self):
+        if self._extra == NONE:
+            return {}
+        compact = (FLAG_VERSION, None, FLAG_ENFORCEMENT, FLAG_SIGNATURE)
+        reserved = ["policy_id"] + [
+            key for key, flag in zip(_TOP_KEYS[1:], compact) if flag is None or self.flags & flag]
+        return self.extra(self._extra, reserved)
+
+    def to_dict(self):
+        doc = {"policy_id": self.policy_id}
+        if self.flags & FLAG_VERSION:
+            doc["version"] = ".".join(map(str, self.version))
+        doc["rules"] = [rule.to_dict() for rule in self.rules]
+        if self.flags & FLAG_ENFORCEMENT:
+            doc["enforcement"] = self.enforcement
+        if self.flags & FLAG_SIGNATURE:
+            doc["signature"] = self.signature
+        doc.update(self.extras)
+        return doc
+
+
+def decode_policy(data):
+    return LazyPolicy(data).to_dict()
+
+
+def compile_policy(policy):
+    """Compile a LazyPolicy straight from its compact fields and token
+    streams. The size limit is the one policy_store applies, on the
+    policy's canonical JSON, so both formats accept the same policies.
+    Policies whose version, enforcement or signature had no compact form
+    are rebuilt as a document and compiled through policy_store instead."""
+    if policy.flags & FLAG_COMPACT != FLAG_COMPACT:
+        return policy_store.compile_policy(policy.to_dict())
+    policy_store.check_policy_size(policy_store.canonical_json(policy.to_dict()))
+    policy_id = policy_store.check_policy_id(policy.policy_id)
+    policy_store.check_signature(policy_id, policy.signature)
+    enforcement = policy_store.check_enforcement(policy_id, policy.enforcement)
+    policy_store.check_rule_count(policy_id, policy.rule_count)
+    compiled = []
+    for rule in policy.rules:
+        message = rule.message
+        if message is None:
+            message = rule.extras.get("message", "")
+        compiled.append(policy_store.compile_rule(
+            policy_id, compiled, rule.id, rule.condition, rule.action, message, rule.tokens or None))
+    return policy_store.CompiledPolicy(
+        policy_id=policy_id,
+        version=policy.version,
+        rules=tuple(compiled),
+        enforcement=enforcement,
+        source=policy,
+    )
+
+
+def encode_bundle(docs):
+    blobs = [encode_policy(doc) for doc in docs]
+    offset = BUNDLE_HEADER.size + U32.size * len(blobs)
+    table = bytearray()
+    for blob in blobs:
+        table += U32.pack(offset)
+        offset += len(blob)
+    return BUNDLE_HEADER.pack(BUNDLE_MAGIC, len(blobs)) + bytes(table) + b"".join(blobs)
+
+
+class PolicyBundle:
+    """Sequence of LazyPolicy views over an encoded bundle."""
+
+    def __init__(self, buf):
+        if len(buf) < BUNDLE_HEADER.size:
+            raise PolicyFormatError("not a policy bundle")
+        magic, self.count = BUNDLE_HEADER.unpack_from(buf, 0)
+        if magic != BUNDLE_MAGIC:
+            raise PolicyFormatError("not a policy bundle")
+        if len(buf) < BUNDLE_HEADER.size + U32.size * self.count:
+            raise PolicyFormatError("truncated bundle offset table")
+        self.buf = buf
+        self._policies = [None] * self.count
+        self._mmap = None
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        bundle = cls(mapped)
+        bundle._mmap = mapped
+        return bundle
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        if self._policies[index] is None:
+            offset = U32.unpack_from(self.buf, BUNDLE_HEADER.size + U32.size * index)[0]
+            self._policies[index] = LazyPolicy(self.buf, offset)
+        return self._policies[index]
+
+    def close(self):
+        self._policies = [None] * self.count
+        if self._mmap is not None:
+            self._mmap.close()
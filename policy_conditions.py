@@ -0,0 +1,162 @@
+"""
+Tiny condition language for nano_policy rules
+Supports: ==, !=, >, <, >=, <=, &&, ||, parentheses
+Identifiers name system_state fields, literals are integers or 'strings'
+"""
+
+import re
+
+# system_state.c: 0=none,1=kyber512,2=dilithium2,3=other
+CRYPTO_ALGORITHMS = ("none", "kyber512", "dilithium2", "other")
+
+# system_state fields and their largest value, in system_state.c order
+SYSTEM_STATE_FIELDS = (
+    ("total_memory", 0xFFFF),
+    ("crypto_algorithm", 0xFF),
+    ("dependency_count", 0xFF),
+    ("execution_time", 0xFFFFFFFF),
+    ("stack_usage", 0xFFFF),
+    ("network_connections", 0xFF),
+    ("uptime", 0xFFFFFFFF),
+)
+
+# Names used by existing policies for the same system_state field
+FIELD_ALIASES = {
+    "crypto_algo": "crypto_algorithm",
+    "memory_allocated": "total_memory",
+}
+
+OPERATORS = ("==", "!=", ">=", "<=", ">", "<")
+
+_TOKEN = re.compile(r"\s*(?:(&&|\|\||==|!=|>=|<=|>|<|\(|\))|'([^']*)'|(-?\d+)|([A-Za-z_]\w*))")
+
+
+class ConditionError(ValueError):
+    pass
+
+
+def tokenize(condition):
+    """Split a condition into (kind, value) tokens; names stay as written."""
+    tokens = []
+    pos = 0
+    condition = condition.rstrip()
+    while pos < len(condition):
+        match = _TOKEN.match(condition, pos)
+        if not match:
+            raise ConditionError(f"unexpected input at {pos}: {condition[pos:]!r}")
+        op, string, number, name = match.groups()
+        if op is not None:
+            tokens.append(("op", op))
+        elif string is not None:
+            tokens.append(("str", string))
+        elif number is not None:
+            tokens.append(("int", int(number)))
+        else:
+            tokens.append(("name", name))
+        pos = match.end()
+    return tokens
+
+
+def parse(condition):
+    """Parse a condition into ("or", ...), ("and", ...) or ("cmp", field, op, value)."""
+    return parse_tokens(tokenize(condition))
+
+
+def parse_tokens(tokens):
+    tokens = list(tokens)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def take(kind, value=None):
+        nonlocal pos
+        tok = peek()
+        if tok[0] != kind or (value is not None and tok[1] != value):
+            raise ConditionError(f"expected {value or kind}, got {tok[1]!r}")
+        pos += 1
+        return tok[1]
+
+    def disjunction():
+        terms = [conjunction()]
+        while peek() == ("op", "||"):
+            take("op", "||")
+            terms.append(conjunction())
+        return terms[0] if len(terms) == 1 else ("or",) + tuple(terms)
+
+    def conjunction():
+        terms = [atom()]
+        while peek() == ("op", "&&"):
+            take("op", "&&")
+            terms.append(atom())
+        return terms[0] if len(terms) == 1 else ("and",) + tuple(terms)
+
+    def atom():
+        if peek() == ("op", "("):
+            take("op", "(")
+            node = disjunction()
+            take("op", ")")
+            return node
+        field = take("name")
+        field = FIELD_ALIASES.get(field, field)
+        op = take("op")
+        if op not in OPERATORS:
+            raise ConditionError(f"expected comparison after {field}, got {op!r}")
+        kind, value = peek()
+        if kind not in ("int", "str"):
+            raise ConditionError(f"expected literal after {field} {op}")
+        take(kind)
+        if kind == "str" and op not in ("==", "!="):
+            raise ConditionError(f"strings only support == and !=: {field} {op}")
+        return ("cmp", field, op, value)
+
+    node = disjunction()
+    if pos != len(tokens):
+        raise ConditionError(f"trailing input: {tokens[pos][1]!r}")
+    return node
+
+
+def normalize_state(state):
+    """Map a system_state dict onto the names and types conditions use."""
+    out = {FIELD_ALIASES.get(k, k): v for k, v in state.items()}
+    algo = out.get("crypto_algorithm")
+    if isinstance(algo, int) and 0 <= algo < len(CRYPTO_ALGORITHMS):
+        out["crypto_algorithm"] = CRYPTO_ALGORITHMS[algo]
+    return out
+
+
+def compare(actual, op, expected):
+    if actual is None or isinstance(actual, str) != isinstance(expected, str):
+        return False  # Unknown fields never trigger a rule
+    if op == "==":
+        return actual == expected
+    if op == "!=":
+        return actual != expected
+    if op == ">":
+        return actual > expected
+    if op == "<":
+        return actual < expected
+    if op == ">=":
+        return actual >= expected
+    return actual <= expected
+
+
+def evaluate(node, state):
+    """Evaluate a parsed condition against a normalized state dict."""
+    kind = node[0]
+    if kind == "cmp":
+        return compare(state.get(node[1]), node[2], node[3])
+    if kind == "and":
+        return all(evaluate(n, state) for n in node[1:])
+    return any(evaluate(n, state) for n in node[1:])
+
+
+def render(tokens):
+    """Canonical text for a token stream (single spaces, tight parens)."""
+    out = ""
+    for kind, value in tokens:
+        text = f"'{value}'" if kind == "str" else str(value)
+        if out and not out.endswith("(") and text != ")":
+            out += " "
+        out += text
+    return out
@@ -0,0 +1,361 @@
+"""
+Hot-reloadable governance policy set
+Policies compile into an immutable, versioned PolicySnapshot.
+Updates build a new snapshot and swap it in with a single reference
+assignment, so enforcement readers never take a lock and an in-flight
+evaluation keeps using the snapshot it started with.
+"""
+
+import json
+import re
+import threading
+from dataclasses import dataclass, field, replace
+from typing import Callable, Optional, Tuple
+
+import policy_analyzer
+import policy_conditions
+
+# Mirrors governance_engine.c and schemas/security_policy.schema
+MAX_POLICIES = 5
+MAX_RULES_PER_POLICY = 10
+MAX_POLICY_SIZE = 1024
+MAX_CONDITION_LENGTH = 256
+ACTIONS = ("allow", "deny", "log", "quarantine", "self_destruct")
+ENFORCEMENT_POINTS = ("compile", "load", "runtime", "update")
+
+POLICY_ID = re.compile(r"^GOV-SEC-[0-9A-F]{8}$")
+VERSION = re.compile(r"^(\d+)\.(\d+)\.(\d+)$")
+HEX = re.compile(r"^[0-9a-fA-F]*$")
+SIGNATURE_LENGTH = 64
+PUBLIC_KEY_LENGTH = 32
+
+# Same rules governance_init() installs; it can be replaced but never unloaded
+DEFAULT_POLICY = {
+    "policy_id": "GOV-SEC-DEFAULT",
+    "version": "1.0.0",
+    "description": "Default quantum-safe policy",
+    "rules": [
+        {
+            "id": "DEF-001",
+            "condition": "crypto_algo != 'kyber512' && crypto_algo != 'dilithium2'",
+            "action": "deny",
+            "message": "Non-quantum-safe algorithm",
+        },
+        {
+            "id": "DEF-002",
+            "condition": "total_memory > 4096",
+            "action": "deny",
+            "message": "Exceeds nano memory limit",
+        },
+        {
+            "id": "DEF-003",
+            "condition": "dependency_count > 0",
+            "action": "deny",
+            "message": "External dependencies forbidden",
+        },
+    ],
+    "enforcement": ["compile", "load", "runtime", "update"],
+}
+
+
+class PolicyError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    id: str
+    condition: str
+    ast: tuple
+    action: str
+    message: str
+
+    def matches(self, state):
+        return policy_conditions.evaluate(self.ast, state)
+
+
+@dataclass(frozen=True)
+class CompiledPolicy:
+    policy_id: str
+    version: Tuple[int, int, int]
+    rules: Tuple[CompiledRule, ...]
+    enforcement: Tuple[str, ...]
+    # Canonical JSON the policy was compiled from, or the
+    # policy_binary.LazyPolicy for policies compiled from a bundle
+    source: object = field(compare=False)
+
+    def to_dict(self):
+        if isinstance(self.source, str):
+            return json.loads(self.source)
+        return self.source.to_dict()
+
+
+@dataclass(frozen=True)
+class PolicySnapshot:
+    version: int
+    policies: Tuple[CompiledPolicy, ...]
+    runtime: Tuple[CompiledPolicy, ...] = ()   # Policies enforced on device state
+    analysis: policy_analyzer.Analysis = policy_analyzer.Analysis()
+
+    def get(self, policy_id):
+        for policy in self.policies:
+            if policy.policy_id == policy_id:
+                return policy
+        return None
+
+    def evaluate(self, state):
+        """Runtime enforcement, in the same decision order as
+        governance_enforce(): first deny, quarantine or self_destruct
+        wins; allow and log keep going. Only policies listing the
+        "runtime" enforcement point take part."""
+        state = policy_conditions.normalize_state(state)
+        if self.analysis.table is not None:
+            decisive, logged = self.analysis.table.lookup(state)
+        else:
+            decisive, logged = self._evaluate_rules(state)
+        logged = [_hit_dict(hit) for hit in logged]
+        if decisive is None:
+            return {"action": "allow", "snapshot_version": self.version, "log": logged}
+        return dict(_hit_dict(decisive), snapshot_version=self.version, log=logged)
+
+    def _evaluate_rules(self, state):
+        logged = []
+        for policy in self.runtime:
+            for rule in policy.rules:
+                if not rule.matches(state):
+                    continue
+                hit = (policy.policy_id, rule.id, rule.action, rule.message)
+                if rule.action not in policy_analyzer.TERMINAL_ACTIONS:
+                    logged.append(hit)
+                    continue
+                return hit, logged
+        return None, logged
+
+
+def _hit_dict(hit):
+    return dict(zip(("policy_id", "rule_id", "action", "message"), hit))
+
+
+def build_snapshot(version, policies):
+    """Analyze a policy set and freeze it; conflicting rules are rejected.
+
+    The decision table covers the runtime policies only; conflicts and
+    unknown fields are checked across every policy, whatever its
+    enforcement points.
+    """
+    runtime = tuple(p for p in policies if "runtime" in p.enforcement)
+    analysis = policy_analyzer.analyze(runtime)
+    if len(runtime) != len(policies):
+        full = policy_analyzer.analyze(policies)
+        skipped = tuple(s for s in analysis.skipped if s[2] != "conflicts") + tuple(
+            s for s in full.skipped if s[2] == "conflicts")
+        analysis = replace(analysis, conflicts=full.conflicts, unknown_fields=full.unknown_fields,
+                           skipped=skipped)
+    if analysis.conflicts:
+        (pa, ra), (pb, rb) = analysis.conflicts[0]
+        raise PolicyError(f"{pa}/{ra} conflicts with {pb}/{rb}")
+    return PolicySnapshot(version, tuple(policies), runtime, analysis)
+
+
+def parse_version(text):
+    match = VERSION.match(text) if isinstance(text, str) else None
+    if not match:
+        raise PolicyError(f"invalid version: {text!r}")
+    return tuple(int(part) for part in match.groups())
+
+
+def check_signature(policy_id, signature):
+    """Schema shape of a dilithium2 signature; placeholders like the short
+    value in example_policy.json are rejected rather than trusted."""
+    if not isinstance(signature, dict) or signature.get("algorithm") != "dilithium2":
+        raise PolicyError(f"{policy_id}: missing dilithium2 signature")
+    for field, length in (("value", SIGNATURE_LENGTH), ("public_key", PUBLIC_KEY_LENGTH)):
+        value = signature.get(field)
+        if not isinstance(value, str) or not HEX.match(value) or len(value) != length:
+            raise PolicyError(f"{policy_id}: signature {field} must be {length} hex characters")
+
+
+def canonical_json(doc):
+    return json.dumps(doc, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def check_policy_size(source):
+    """MAX_POLICY_SIZE applies to the canonical JSON, however the policy arrived."""
+    if len(source.encode()) > MAX_POLICY_SIZE:
+        raise PolicyError(f"policy exceeds {MAX_POLICY_SIZE} bytes")
+
+
+def check_policy_id(policy_id):
+    if not isinstance(policy_id, str) or (
+            not POLICY_ID.match(policy_id) and policy_id != DEFAULT_POLICY["policy_id"]):
+        raise PolicyError(f"invalid policy_id: {policy_id!r}")
+    return policy_id
+
+
+def check_enforcement(policy_id, enforcement):
+    if not isinstance(enforcement, list) or any(p not in ENFORCEMENT_POINTS for p in enforcement):
+        raise PolicyError(f"{policy_id}: invalid enforcement points")
+    return tuple(enforcement)
+
+
+def check_rule_count(policy_id, count):
+    if count > MAX_RULES_PER_POLICY:
+        raise PolicyError(f"{policy_id}: rules must be a list of at most {MAX_RULES_PER_POLICY}")
+
+
+def compile_rule(policy_id, compiled, rule_id, condition, action, message, tokens=None):
+    """Validate one rule against the rules ``compiled`` so far.
+
+    ``tokens`` is the condition's pre-tokenized form (policy_binary);
+    when given it is parsed instead of the condition text.
+    """
+    if not isinstance(rule_id, str) or any(r.id == rule_id for r in compiled):
+        raise PolicyError(f"{policy_id}: missing or duplicate rule id {rule_id!r}")
+    if not isinstance(condition, str) or len(condition) > MAX_CONDITION_LENGTH:
+        raise PolicyError(f"{policy_id}/{rule_id}: invalid condition")
+    if action not in ACTIONS:
+        raise PolicyError(f"{policy_id}/{rule_id}: invalid action {action!r}")
+    if not isinstance(message, str):
+        raise PolicyError(f"{policy_id}/{rule_id}: message must be a string")
+    try:
+        if tokens is None:
+            ast = policy_conditions.parse(condition)
+        else:
+            ast = policy_conditions.parse_tokens(tokens)
+    except policy_conditions.ConditionError as exc:
+        raise PolicyError(f"{policy_id}/{rule_id}: {exc}") from None
+    return CompiledRule(rule_id, condition, ast, action, message)
+
+
+def compile_policy(doc, builtin=False):
+    """Validate a policy document against the schema limits and compile it."""
+    if not isinstance(doc, dict):
+        raise PolicyError("policy must be an object")
+    source = canonical_json(doc)
+    if not builtin:
+        check_policy_size(source)
+
+    policy_id = check_policy_id(doc.get("policy_id"))
+    if not builtin:
+        check_signature(policy_id, doc.get("signature"))
+    enforcement = check_enforcement(policy_id, doc.get("enforcement"))
+
+    rules = doc.get("rules")
+    if not isinstance(rules, list):
+        raise PolicyError(f"{policy_id}: rules must be a list of at most {MAX_RULES_PER_POLICY}")
+    check_rule_count(policy_id, len(rules))
+    compiled = []
+    for rule in rules:
+        if not isinstance(rule, dict):
+            raise PolicyError(f"{policy_id}: rules must be objects")
+        compiled.append(compile_rule(
+            policy_id, compiled, rule.get("id"), rule.get("condition"),
+            rule.get("action"), rule.get("message", "")))
+
+    return CompiledPolicy(
+        policy_id=policy_id,
+        version=parse_version(doc.get("version", "0.0.0")),
+        rules=tuple(compiled),
+        enforcement=enforcement,
+        source=source,
+    )
+
+
+def validate_migration(current, policies):
+    """update_time enforcement: reject pushes that would downgrade or
+    drop governance the fleet already depends on."""
+    if len(policies) > MAX_POLICIES:
+        raise PolicyError(f"at most {MAX_POLICIES} policies may be active")
+    ids = [p.policy_id for p in policies]
+    if len(set(ids)) != len(ids):
+        raise PolicyError("duplicate policy_id")
+    if DEFAULT_POLICY["policy_id"] not in ids:
+        raise PolicyError("the default quantum-safe policy cannot be unloaded")
+    for policy in policies:
+        if policy.policy_id == DEFAULT_POLICY["policy_id"]:
+            kept = {(rule.ast, rule.action) for rule in policy.rules}
+            missing = [rule.id for rule in DEFAULT_RULES if (rule.ast, rule.action) not in kept]
+            if missing:
+                raise PolicyError(
+                    f"{policy.policy_id}: replacement drops required rules {', '.join(missing)}")
+        previous = current.get(policy.policy_id)
+        if previous is None or previous is policy:
+            continue
+        if policy.version <= previous.version:
+            raise PolicyError(
+                f"{policy.policy_id}: version must increase on update "
+                f"({'.'.join(map(str, previous.version))} -> {'.'.join(map(str, policy.version))})"
+            )
+
+
+# Constraints every replacement of the default policy must keep
+DEFAULT_RULES = compile_policy(DEFAULT_POLICY, builtin=True).rules
+
+
+class PolicyStore:
+    """Holds the active PolicySnapshot.
+
+    Writers serialize on a lock; readers just grab ``snapshot`` and keep
+    using that object for the whole evaluation.
+    """
+
+    def __init__(self, verify_signature: Optional[Callable[[dict], bool]] = None):
+        # Dilithium-2 verification lives in the crypto module. Until it is
+        # wired in, well-formed signatures are accepted for ordinary
+        # policies but the default policy cannot be replaced at all.
+        self._verify = verify_signature
+        self._write_lock = threading.Lock()
+        self.snapshot = build_snapshot(0, [compile_policy(DEFAULT_POLICY, builtin=True)])
+
+    def evaluate(self, state):
+        return self.snapshot.evaluate(state)
+
+    def update(self, load=(), unload=()):
+        """Atomically load/replace and unload policies; returns the new
+        snapshot (the current one, unchanged, when there is nothing to do).
+
+        ``load`` items are policy documents or CompiledPolicy objects.
+        """
+        if not isinstance(load, (list, tuple)):
+            raise PolicyError("load must be a list of policies")
+        if not isinstance(unload, (list, tuple)) or not all(isinstance(i, str) for i in unload):
+            raise PolicyError("unload must be a list of policy ids")
+        if not load and not unload:
+            return self.snapshot
+        compiled = []
+        for doc in load:
+            # Accept documents or policies already compiled elsewhere
+            policy = doc if isinstance(doc, CompiledPolicy) else compile_policy(doc)
+            if self._verify is None:
+                if policy.policy_id == DEFAULT_POLICY["policy_id"]:
+                    raise PolicyError(
+                        f"{policy.policy_id}: replacing the default policy requires a signature verifier")
+            elif not self._verify(policy.to_dict()):
+                raise PolicyError(f"{policy.policy_id}: invalid signature")
+            compiled.append(policy)
+
+        with self._write_lock:
+            current = self.snapshot
+            incoming = {p.policy_id: p for p in compiled}
+            if len(incoming) != len(compiled):
+                raise PolicyError("duplicate policy_id in update")
+            for policy_id in unload:
+                if current.get(policy_id) is None:
+                    raise PolicyError(f"unknown policy_id: {policy_id!r}")
+                if policy_id in incoming:
+                    raise PolicyError(f"{policy_id}: cannot load and unload in one update")
+            policies = [
+                incoming.pop(p.policy_id, p)
+                for p in current.policies
+                if p.policy_id not in unload
+            ]
+            policies.extend(incoming.values())
+            validate_migration(current, policies)
+            self.snapshot = build_snapshot(current.version + 1, policies)
+            return self.snapshot
+
+    def load_policy(self, doc):
+        return self.update(load=[doc])
+
+    def unload_policy(self, policy_id):
+        return self.update(unload=[policy_id])
@@ -0,0 +1,122 @@
+"""
+Policy set shared by every worker process
+PolicyStore swaps snapshots inside one process, but each gunicorn worker
+has its own. SharedPolicyStore publishes every update as a versioned
+policy bundle in one file, replaced atomically (warm_state.write_atomic)
+under an flock. Each read stat()s the file and adopts the published set
+when it changed before returning a snapshot, so a push to any worker is what every worker
+enforces from its next request on. Within a process readers still just
+take ``snapshot`` without a lock.
+"""
+
+import fcntl
+import logging
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+import policy_binary
+import warm_state
+from policy_store import DEFAULT_POLICY, PolicyStore, build_snapshot, compile_policy
+
+MAGIC = b"NPS1"
+HEADER = struct.Struct("<4sQ")   # magic, snapshot version; a policy_binary bundle follows
+
+logger = logging.getLogger(__name__)
+
+
+def read_published(path):
+    """(version, bundle bytes) of the set published at ``path``, or None."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < HEADER.size or data[:4] != MAGIC:
+        raise policy_binary.PolicyFormatError(f"{path}: not a published policy set")
+    return HEADER.unpack_from(data)[1], data[HEADER.size:]
+
+
+def _compile(policy):
+    # The built-in default carries no signature; recompile it as governance_init() would
+    doc = policy.to_dict()
+    if doc == DEFAULT_POLICY:
+        return compile_policy(doc, builtin=True)
+    return policy_binary.compile_policy(policy)
+
+
+class SharedPolicyStore(PolicyStore):
+    """PolicyStore whose policy set lives in the file at ``path``."""
+
+    def __init__(self, path, verify_signature=None):
+        self.path = path
+        self._identity = None        # stat() of the file self._snapshot came from
+        self._reload_lock = threading.Lock()
+        super().__init__(verify_signature)
+        self._refresh()
+
+    @property
+    def snapshot(self):
+        self._refresh()
+        return self._snapshot
+
+    @snapshot.setter
+    def snapshot(self, snapshot):
+        self._snapshot = snapshot
+
+    def _refresh(self):
+        """Adopt the published set if it changed; False if none is published."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if identity == self._identity:
+            return True
+        with self._reload_lock:
+            if identity == self._identity:
+                return True
+            try:
+                published = read_published(self.path)
+                if published is not None and published[0] != self._snapshot.version:
+                    version, bundle = published
+                    policies = [_compile(p) for p in policy_binary.PolicyBundle(bundle)]
+                    self._snapshot = build_snapshot(version, policies)
+            except (ValueError, IndexError, struct.error) as exc:
+                # Keep enforcing the last good set rather than fail every request
+                logger.error("ignoring unreadable policy set %s: %s", self.path, exc)
+            self._identity = identity
+        return True
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.path + ".lock", "a+b") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _publish(self, snapshot):
+        docs = [p.to_dict() for p in snapshot.policies]
+        warm_state.write_atomic(self.path, [HEADER.pack(MAGIC, snapshot.version),
+                                            policy_binary.encode_bundle(docs)])
+        st = os.stat(self.path)
+        with self._reload_lock:
+            self._identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def update(self, load=(), unload=()):
+        with self._file_lock():
+            published = self._refresh()
+            current = self._snapshot
+            snapshot = super().update(load, unload)
+            if snapshot is current and published:
+                return snapshot
+            return self._publish(snapshot)
+
+    def seed(self, load):
+        """Publish ``load`` (e.g. policies from a warm snapshot) as the
+        first policy set, unless a worker has already published one."""
+        with self._file_lock():
+            if self._refresh():
+                return self._snapshot
+            return self._publish(super().update(load))
@@ -0,0 +1,109 @@
+import fcntl
+import glob
+import os
+import tempfile
+import uuid
+
+import pytest
+
+pytest.importorskip("flask")
+
+import apps
+import warm_state
+from device_shards import RECORD, ShardDispatcher
+
+DEVICE = "00000000000000aa"
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """apps.py with its own warm snapshot, policy set and registry, built cold."""
+    prefix = f"test-apps-{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(apps, "WARM_STATE_PATH", str(tmp_path / "warm"))
+    monkeypatch.setattr(apps, "POLICY_SET_PATH", str(tmp_path / "policies"))
+    monkeypatch.setattr(apps, "SHARD_PREFIX", prefix)
+    monkeypatch.setattr(apps, "SYNC_SHARDS", 2)
+    monkeypatch.setattr(apps, "WARM_STATE_INTERVAL", 0)   # No periodic saver thread
+    for name in ("dispatcher", "policies", "warm", "_writer_lock"):
+        monkeypatch.setattr(apps, name, None)
+    yield apps.app.test_client()
+    if apps._writer_lock is not None:
+        apps._writer_lock.close()
+    _drop_registry(prefix)
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), f"{prefix}*.lock")):
+        os.remove(path)
+
+
+def _drop_registry(prefix):
+    if apps.dispatcher is not None:
+        apps.dispatcher.close()
+    shards = ShardDispatcher.attach(prefix)
+    if shards is not None:
+        shards.unlink()
+        shards.close()
+
+
+def restart():
+    """A fresh boot: only the warm snapshot survives."""
+    _drop_registry(apps.SHARD_PREFIX)
+    os.remove(apps.POLICY_SET_PATH)
+    apps.dispatcher = apps.policies = apps.warm = None
+
+
+def test_save_and_restore(backend, make_policy):
+    doc = make_policy("GOV-SEC-00000001", [("uptime > 5", "quarantine")])
+    assert backend.post("/python/policies", json=doc).status_code == 200
+    backend.post("/python/device-sync",
+                 json={"device_id": DEVICE, "system_state": {"uptime": 9, "crypto_algorithm": 1}})
+    assert apps.save_warm_state()
+
+    restart()
+    assert apps.get_policies().snapshot.get("GOV-SEC-00000001") is not None
+    assert apps.get_dispatcher().lookup(DEVICE)["system_state"]["uptime"] == 9
+    decisions = backend.post("/python/device-sync", json={"device_id": DEVICE}).get_json()["decisions"]
+    assert [d["action"] for d in decisions] == ["quarantine"]
+
+
+def test_damaged_sections_start_cold(backend):
+    warm_state.save(apps.WARM_STATE_PATH, {
+        warm_state.POLICIES: b"NPB1 but not really",
+        warm_state.DEVICES: bytes(RECORD.size + 1),
+    })
+    assert [p.policy_id for p in apps.get_policies().snapshot.policies] == ["GOV-SEC-DEFAULT"]
+    assert apps.get_dispatcher().export_records() == b""
+
+
+def test_one_writer_per_snapshot(backend):
+    backend.post("/python/device-sync", json={"device_id": DEVICE})
+    with open(apps.WARM_STATE_PATH + ".lock", "a+b") as other_worker:
+        fcntl.flock(other_worker, fcntl.LOCK_EX)
+        assert not apps.save_warm_state()
+        assert not os.path.exists(apps.WARM_STATE_PATH)
+    assert apps.save_warm_state()
+    assert os.path.exists(apps.WARM_STATE_PATH)
+
+
+def test_saves_what_other_workers_published(backend, make_policy):
+    # This process never built its own store or attached to the registry
+    other = ShardDispatcher.open(apps.SHARD_PREFIX, 2)
+    other.dispatch([{"device_id": DEVICE}])
+    other.close()
+    from shared_policies import SharedPolicyStore
+    SharedPolicyStore(apps.POLICY_SET_PATH).load_policy(
+        make_policy("GOV-SEC-00000001", [("uptime > 5", "quarantine")]))
+
+    assert apps.save_warm_state()
+    assert apps.policies is None and apps.dispatcher is None
+    saved = warm_state.WarmState.open(apps.WARM_STATE_PATH)
+    assert len(saved.section(warm_state.DEVICES)) == RECORD.size
+    assert b"GOV-SEC-00000001" in bytes(saved.section(warm_state.POLICIES))
+
+
+def test_first_response_metric_waits_for_a_real_request(backend, monkeypatch):
+    monkeypatch.setitem(apps.metrics, "time_to_first_response_ms", None)
+    monkeypatch.setitem(apps.metrics, "init_ms", {})
+    backend.get("/python/metrics")
+    assert apps.metrics["time_to_first_response_ms"] is None
+    backend.post("/python/device-sync", json={"device_id": DEVICE})
+    assert apps.metrics["time_to_first_response_ms"] is not None
+    assert set(apps.metrics["init_ms"]) >= {"dispatcher", "policies"}
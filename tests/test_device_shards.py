@@ -0,0 +1,158 @@
+import glob
+import os
+import struct
+import tempfile
+import uuid
+
+import pytest
+
+import device_shards
+from device_shards import RECORD, ShardDispatcher, TornRecordError, parse_device_id, shard_of
+from policy_conditions import SYSTEM_STATE_FIELDS
+
+
+def device(n):
+    return f"{n:016x}"
+
+
+@pytest.fixture
+def registry():
+    """Open dispatchers on a prefix unique to the test; unlinked afterwards."""
+    prefix = f"test-devices-{uuid.uuid4().hex[:8]}"
+    opened = []
+
+    def open_registry(**kwargs):
+        dispatcher = ShardDispatcher.open(prefix, **kwargs)
+        opened.append(dispatcher)
+        return dispatcher
+
+    open_registry.prefix = prefix
+    yield open_registry
+    for dispatcher in opened:
+        dispatcher.close()
+    if opened:
+        ShardDispatcher.open(prefix).unlink()
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), f"{prefix}*.lock")):
+        os.remove(path)
+
+
+def test_dispatch_reports_each_bad_record(registry, monkeypatch):
+    shards = registry(shard_count=1, capacity=3)
+    real_apply = device_shards._apply
+
+    def apply(table, record):
+        if record["device_id"] == device(4):
+            raise RuntimeError("boom")
+        real_apply(table, record)
+
+    monkeypatch.setattr(device_shards, "_apply", apply)
+    result = shards.dispatch([
+        {"device_id": device(1), "system_state": {"total_memory": 10}},
+        "not a record",
+        {"device_id": "xyz"},
+        {"device_id": device(2), "system_state": {"uptime": "long"}},
+        {"device_id": device(3)},
+        {"device_id": device(4)},
+        {"device_id": device(5)},
+        {"device_id": device(6)},
+    ])
+    assert result["synced"] == 3
+    errors = {error["device_id"]: error["error"] for error in result["errors"]}
+    assert set(errors) == {None, "xyz", device(2), device(4), device(6)}
+    assert errors[device(4)] == "internal error: RuntimeError"
+    assert errors[device(6)] == "device table full"
+    assert shards.lookup(device(1))["system_state"]["total_memory"] == 10
+    assert shards.lookup(device(2)) is None
+
+
+def test_null_and_missing_fields_keep_previous_values(registry):
+    shards = registry(shard_count=2)
+    shards.dispatch([{"device_id": device(1), "system_state": {"total_memory": 10, "uptime": 5}}])
+    shards.dispatch([{"device_id": device(1), "system_state": {"total_memory": None, "uptime": 6}}])
+    state = shards.lookup(device(1))["system_state"]
+    assert (state["total_memory"], state["uptime"]) == (10, 6)
+
+
+def test_torn_record(registry, monkeypatch):
+    monkeypatch.setattr(device_shards, "READ_RETRIES", 3)
+    shards = registry(shard_count=1, capacity=4)
+    shards.dispatch([{"device_id": device(1), "system_state": {"uptime": 1}},
+                     {"device_id": device(2), "system_state": {"uptime": 2}}])
+    # Leave device 1 as a writer that died mid-write would
+    table = shards.tables[0]
+    slot = table._find(parse_device_id(device(1)), claim=False)
+    seq = struct.unpack_from("<I", table.shm.buf, slot * RECORD.size)[0]
+    struct.pack_into("<I", table.shm.buf, slot * RECORD.size, seq + 1)
+
+    with pytest.raises(TornRecordError):
+        shards.lookup(device(1))
+    assert shards.lookup_or_none(device(1)) is None
+    assert [RECORD.unpack(record)[1] for record in table.records()] == [parse_device_id(device(2))]
+
+    # The next write repairs it
+    assert shards.dispatch([{"device_id": device(1), "system_state": {"uptime": 3}}])["synced"] == 1
+    assert shards.lookup(device(1))["system_state"]["uptime"] == 3
+
+
+def test_trust_comes_only_from_set_trust(registry):
+    shards = registry(shard_count=2)
+    shards.dispatch([{"device_id": device(1), "trust": 255}])
+    assert shards.lookup(device(1))["trust"] == 0
+
+    shards.set_trust(device(1), 7)
+    shards.dispatch([{"device_id": device(1), "trust": 0, "system_state": {"uptime": 9}}])
+    state = shards.lookup(device(1))
+    assert (state["trust"], state["system_state"]["uptime"]) == (7, 9)
+
+    with pytest.raises(KeyError):
+        shards.set_trust(device(2), 7)
+
+
+def test_attach_uses_creator_layout(registry):
+    creator = registry(shard_count=3, capacity=16)
+    attached = registry(shard_count=1, capacity=2)
+    assert (creator.owner, attached.owner) == (True, False)
+    assert (attached.shard_count, attached.capacity) == (3, 16)
+
+    attached.dispatch([{"device_id": device(n)} for n in range(1, 11)])
+    assert all(creator.lookup(device(n)) for n in range(1, 11))
+
+
+def test_unpublished_registry_is_rebuilt(registry):
+    # A creator that died after creating meta and one shard, before publishing
+    device_shards._segment(f"{registry.prefix}-meta", create=True, size=device_shards.META.size).close()
+    device_shards.DeviceStateTable(f"{registry.prefix}-0", 4, create=True).close()
+
+    shards = registry(shard_count=2, capacity=8)
+    assert shards.owner and (shards.shard_count, shards.capacity) == (2, 8)
+    shards.dispatch([{"device_id": device(1)}])
+    assert registry().lookup(device(1))
+
+
+def test_warm_records_restore(registry):
+    source = registry(shard_count=2, capacity=8)
+    source.dispatch([{"device_id": device(n), "system_state": {"uptime": n}} for n in range(1, 7)])
+    source.set_trust(device(1), 3)
+    warm = source.export_records()
+    assert len(warm) == 6 * RECORD.size
+    source.unlink()
+
+    restored = ShardDispatcher.open(f"{registry.prefix}-warm", shard_count=3, capacity=4,
+                                    warm_records=warm)
+    try:
+        assert restored.lookup(device(1))["trust"] == 3
+        assert [restored.lookup(device(n))["system_state"]["uptime"] for n in range(1, 7)] == list(range(1, 7))
+    finally:
+        restored.unlink()
+        restored.close()
+
+
+def test_warm_records_that_dont_fit_start_cold(registry):
+    ids = [device(n) for n in range(1, 41)]
+    # Enough devices that one shard of two slots must overflow
+    assert max(sum(shard_of(parse_device_id(i), 2) == s for i in ids) for s in range(2)) > 2
+    warm = b"".join(RECORD.pack(0, parse_device_id(i), 0, 0, *[0] * len(SYSTEM_STATE_FIELDS)) for i in ids)
+
+    shards = registry(shard_count=2, capacity=2, warm_records=warm)
+    assert all(shards.lookup(i) is None for i in ids)
+    assert shards.export_records() == b""
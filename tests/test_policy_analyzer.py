@@ -0,0 +1,150 @@
+import random
+
+import pytest
+
+import policy_conditions
+from policy_store import DEFAULT_POLICY, PolicyError, build_snapshot, compile_policy
+
+DEFAULT = compile_policy(DEFAULT_POLICY, builtin=True)
+
+
+def snapshot(*docs):
+    return build_snapshot(1, [DEFAULT] + [compile_policy(doc) for doc in docs])
+
+
+def random_state(rng):
+    state = {}
+    for field, limit in policy_conditions.SYSTEM_STATE_FIELDS:
+        if rng.random() < 0.9:
+            state[field] = rng.choice([0, 1, 2, 100, 101, 200, 4096, 4097, limit, rng.randint(0, limit)])
+    if rng.random() < 0.1:
+        state["crypto_algorithm"] = rng.choice(["kyber512", "rsa", 99.5])
+    if rng.random() < 0.1:
+        state["memory_allocated"] = rng.randint(0, 8192)
+    return state
+
+
+def test_table_matches_sequential_rules(example_policy, make_policy):
+    extra = make_policy("GOV-SEC-00000001", [
+        ("uptime > 10 || (stack_usage >= 200 && network_connections == 2)", "log"),
+        ("total_memory == 4096 && crypto_algo == 'kyber512' && dependency_count == 0", "allow"),
+        ("stack_usage > 4000 && total_memory < 4096", "quarantine"),
+    ])
+    snap = snapshot(example_policy, extra)
+    assert snap.analysis.table is not None
+
+    rng = random.Random(0)
+    for _ in range(5000):
+        state = random_state(rng)
+        decisive, logged = snap._evaluate_rules(policy_conditions.normalize_state(state))
+        decision = snap.evaluate(state)
+        expected = (decisive[0], decisive[1]) if decisive else (None, None)
+        assert (decision.get("policy_id"), decision.get("rule_id")) == expected, state
+        assert [hit["rule_id"] for hit in decision["log"]] == [hit[1] for hit in logged], state
+
+
+def test_allow_overlapping_a_deny_is_a_conflict(make_policy):
+    doc = make_policy("GOV-SEC-00000001", [
+        ("total_memory > 9000 && crypto_algo == 'kyber512'", "allow"),
+    ])
+    with pytest.raises(PolicyError, match="DEF-002 conflicts with GOV-SEC-00000001/R-000"):
+        snapshot(doc)
+
+
+def test_conflicts_checked_across_non_runtime_policies(make_policy):
+    doc = make_policy("GOV-SEC-00000001", [
+        ("dependency_count == 3 && crypto_algo == 'kyber512' && total_memory < 100", "allow"),
+    ], enforcement=["compile"])
+    with pytest.raises(PolicyError, match="DEF-003"):
+        snapshot(doc)
+
+
+def test_disjoint_allow_is_not_a_conflict(make_policy):
+    doc = make_policy("GOV-SEC-00000001", [
+        ("total_memory <= 4096 && dependency_count == 0 && crypto_algo == 'kyber512'", "allow"),
+    ])
+    assert snapshot(doc).analysis.conflicts == ()
+
+
+def test_overlap_outside_field_range_is_not_a_conflict(make_policy):
+    doc = make_policy("GOV-SEC-00000001", [("total_memory > 70000", "allow")])
+    assert snapshot(doc).analysis.conflicts == ()
+
+
+def test_shadowed_rule(make_policy):
+    doc = make_policy("GOV-SEC-00000001", [
+        ("total_memory > 5000", "quarantine"),
+        ("total_memory > 4000", "log"),
+    ])
+    analysis = snapshot(doc).analysis
+    assert analysis.shadowed == (("GOV-SEC-00000001", "R-000"),)
+    assert analysis.unsatisfiable == ()
+
+
+@pytest.mark.parametrize("condition", [
+    "total_memory > 70000",
+    "total_memory < 0",
+    "crypto_algorithm == 'rsa'",
+    "crypto_algorithm == 2",
+    "execution_time_variance > 100",
+    "uptime > 4294967295",
+])
+def test_unsatisfiable_within_field_ranges(make_policy, condition):
+    doc = make_policy("GOV-SEC-00000001", [(condition, "log")])
+    assert snapshot(doc).analysis.unsatisfiable == (("GOV-SEC-00000001", "R-000"),)
+
+
+def test_unknown_fields_reported(example_policy):
+    analysis = snapshot(example_policy).analysis
+    assert analysis.unknown_fields == (("GOV-SEC-AA11BB22", "TIME-001", "execution_time_variance"),)
+    assert ("GOV-SEC-AA11BB22", "TIME-001") in analysis.unsatisfiable
+
+
+def test_mixed_literal_types(make_policy):
+    doc = make_policy("GOV-SEC-00000001", [("crypto_algorithm == 7", "quarantine")])
+    snap = snapshot(doc)
+    assert snap.analysis.unsatisfiable == ()
+    assert snap.evaluate({"crypto_algorithm": 7})["action"] == "quarantine"
+    assert snap.evaluate({"crypto_algorithm": 1})["action"] == "allow"
+
+
+def test_rules_covered_by_several_earlier_rules_are_shadowed(make_policy):
+    doc = make_policy("GOV-SEC-00000001", [
+        ("uptime < 100", "quarantine"),
+        ("uptime >= 50 && stack_usage > 10", "deny"),
+        ("uptime < 200 && stack_usage > 20", "log"),
+        ("uptime < 200 && stack_usage > 5", "log"),
+    ])
+    assert snapshot(doc).analysis.shadowed == (("GOV-SEC-00000001", "R-002"),)
+
+
+def test_many_fields_keep_the_table_and_checks(make_policy):
+    small = make_policy("GOV-SEC-00000001", [
+        ("total_memory > 5000", "quarantine"),
+        ("total_memory > 6000", "log"),
+    ])
+    wide = make_policy("GOV-SEC-00000002", [
+        (f"uptime > {n} && stack_usage < {100 * n} && execution_time != {7 * n}", "log")
+        for n in range(1, 8)
+    ])
+    snap = snapshot(small, wide)
+    assert snap.analysis.table is not None
+    assert snap.analysis.shadowed == (("GOV-SEC-00000001", "R-000"), ("GOV-SEC-00000001", "R-001"))
+    assert snap.analysis.skipped == ()
+
+    rng = random.Random(1)
+    for _ in range(2000):
+        state = policy_conditions.normalize_state(random_state(rng))
+        decisive, logged = snap._evaluate_rules(state)
+        assert snap.analysis.table.lookup(state) == (decisive, tuple(logged)), state
+
+
+def test_oversized_conditions_are_reported_as_skipped(make_policy):
+    # 2**9 boxes: every term picks one side of each ||
+    condition = "&&".join(f"({a}==1||{b}==1)" for a, b in zip("abcdefghi", "jklmnopqr"))
+    doc = make_policy("GOV-SEC-00000001", [(condition, "log")])
+    analysis = snapshot(doc).analysis
+    key = ("GOV-SEC-00000001", "R-000")
+    assert {check for *rule, check in analysis.skipped if tuple(rule) == key} == {
+        "conflicts", "shadowed", "unsatisfiable"}
+    assert analysis.table is not None
@@ -0,0 +1,102 @@
+import json
+import struct
+
+import pytest
+
+import policy_binary
+import policy_store
+from policy_binary import PolicyBundle, PolicyFormatError, decode_policy, encode_bundle, encode_policy
+
+
+def unusual_policies(example_policy):
+    """Documents exercising every non-compact fallback."""
+    rules = example_policy["rules"]
+    return [
+        policy_store.DEFAULT_POLICY,
+        dict(example_policy, version="01.0.0", enforcement=["runtime", "compile"]),
+        dict(example_policy, signature={"algorithm": "dilithium2", "value": "xyz"}),
+        dict(example_policy, owner={"team": "fleet", "tags": [1, 2]}, description="Mémoire"),
+        dict(example_policy, rules=[
+            dict(rules[0], condition="memory_allocated>4096"),
+            dict(rules[1], message=7, severity="high"),
+            {"id": "BAD-1", "condition": "((", "action": "log"},
+            {"id": "BIG-1", "condition": "uptime < -9223372036854775808", "action": "log"},
+        ]),
+    ]
+
+
+def test_round_trip(example_policy):
+    for doc in [example_policy] + unusual_policies(example_policy):
+        assert decode_policy(encode_policy(doc)) == doc
+
+
+def test_bundle_round_trip_via_mmap(example_policy, tmp_path):
+    docs = [example_policy] + unusual_policies(example_policy)
+    path = tmp_path / "policies.npb"
+    path.write_bytes(encode_bundle(docs))
+    bundle = PolicyBundle.open(str(path))
+    try:
+        assert len(bundle) == len(docs)
+        assert [policy.to_dict() for policy in bundle] == docs
+    finally:
+        bundle.close()
+
+
+def test_binary_is_smaller_than_json(example_policy):
+    assert len(encode_policy(example_policy)) < len(json.dumps(example_policy))
+
+
+def test_compile_matches_document_path(example_policy):
+    from_binary = policy_binary.compile_policy(policy_binary.LazyPolicy(encode_policy(example_policy)))
+    assert from_binary == policy_store.compile_policy(example_policy)
+    assert from_binary.to_dict() == example_policy
+
+
+def test_compile_uses_override_text_not_tokens(example_policy):
+    doc = dict(example_policy, rules=[dict(example_policy["rules"][0], condition="total_memory>4096")])
+    policy = policy_binary.LazyPolicy(encode_policy(doc))
+    assert policy.rule(0).tokens == []
+    compiled = policy_binary.compile_policy(policy)
+    assert compiled.rules[0].condition == "total_memory>4096"
+    assert compiled.rules[0].ast == ("cmp", "total_memory", ">", 4096)
+
+
+def test_size_limit_matches_document_path(make_policy):
+    # Repeated strings are stored once, so the binary form fits where the JSON doesn't
+    doc = make_policy("GOV-SEC-00000001", [("uptime > 10", "log")] * 10)
+    for rule in doc["rules"]:
+        rule["message"] = "Device has been up longer than the rollout window allows"
+    assert len(encode_policy(doc)) <= policy_store.MAX_POLICY_SIZE
+    with pytest.raises(policy_store.PolicyError, match="exceeds"):
+        policy_store.compile_policy(doc)
+    with pytest.raises(policy_store.PolicyError, match="exceeds"):
+        policy_binary.compile_policy(policy_binary.LazyPolicy(encode_policy(doc)))
+
+
+def _replace(blob, old, new):
+    assert len(old) == len(new) and blob.count(old) == 1
+    return blob.replace(old, new)
+
+
+def malformed_bundles(example_policy):
+    blob = encode_bundle([example_policy])
+    yield b""
+    yield b"XXXX" + blob[4:]
+    yield blob[:4] + struct.pack("<H", 9) + blob[6:]
+    for length in range(len(blob) - 1, 0, -97):
+        yield blob[:length]
+    # Extra JSON that isn't an object, or repeats a compact key
+    doc = {key: value for key, value in example_policy.items() if key != "description"}
+    tagged = encode_bundle([dict(doc, zz="abcdefgh")])
+    yield _replace(tagged, b'{"zz":"abcdefgh"}', b'["zz","abcdefgh"]')
+    yield _replace(tagged, b'{"zz":"abcdefgh"}', b'{"rules":"abcde"}')
+    yield _replace(tagged, b'{"zz":"abcdefgh"}', b'{"zz":"abc\xff\xfefgh"}')
+    # Action code past the end of ACTIONS
+    offset = struct.unpack_from("<I", blob, 6)[0] + policy_binary.HEADER.size + 2
+    yield blob[:offset] + b"\x09" + blob[offset + 1:]
+
+
+def test_malformed_bundles_rejected(example_policy):
+    for data in malformed_bundles(example_policy):
+        with pytest.raises(PolicyFormatError):
+            [policy_binary.compile_policy(policy) for policy in PolicyBundle(data)]
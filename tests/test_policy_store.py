@@ -0,0 +1,85 @@
+import pytest
+
+from policy_store import DEFAULT_POLICY, MAX_POLICIES, PolicyError, PolicyStore
+
+QUARANTINE_UPTIME = [("uptime > 5", "quarantine")]
+
+
+def default_replacement(**changes):
+    doc = dict(DEFAULT_POLICY, version="1.1.0",
+               signature={"algorithm": "dilithium2", "value": "ab" * 32, "public_key": "cd" * 16})
+    doc.update(changes)
+    return doc
+
+
+def test_unload_unknown_policy():
+    store = PolicyStore()
+    with pytest.raises(PolicyError, match="unknown policy_id"):
+        store.unload_policy("GOV-SEC-00000001")
+    assert store.snapshot.version == 0
+
+
+def test_load_and_unload_same_policy(make_policy):
+    store = PolicyStore()
+    store.load_policy(make_policy("GOV-SEC-00000001", QUARANTINE_UPTIME))
+    with pytest.raises(PolicyError, match="cannot load and unload"):
+        store.update(load=[make_policy("GOV-SEC-00000001", QUARANTINE_UPTIME, version="1.1.0")],
+                     unload=["GOV-SEC-00000001"])
+    assert store.snapshot.version == 1
+
+
+def test_empty_update_keeps_the_snapshot():
+    store = PolicyStore()
+    assert store.update() is store.snapshot
+    assert store.snapshot.version == 0
+
+
+def test_replacement_version_must_increase(make_policy):
+    store = PolicyStore()
+    store.load_policy(make_policy("GOV-SEC-00000001", QUARANTINE_UPTIME, version="1.2.0"))
+    for version in ("1.2.0", "1.1.9"):
+        with pytest.raises(PolicyError, match="version must increase"):
+            store.load_policy(make_policy("GOV-SEC-00000001", [("uptime > 9", "log")], version=version))
+    snapshot = store.load_policy(make_policy("GOV-SEC-00000001", [("uptime > 9", "log")], version="1.10.0"))
+    assert snapshot.get("GOV-SEC-00000001").version == (1, 10, 0)
+
+
+def test_policy_limit(make_policy):
+    store = PolicyStore()
+    for n in range(1, MAX_POLICIES):
+        store.load_policy(make_policy(f"GOV-SEC-0000000{n}", QUARANTINE_UPTIME))
+    with pytest.raises(PolicyError, match=f"at most {MAX_POLICIES}"):
+        store.load_policy(make_policy("GOV-SEC-0000000F", QUARANTINE_UPTIME))
+    assert len(store.snapshot.policies) == MAX_POLICIES
+
+
+def test_default_policy_needs_a_verifier():
+    store = PolicyStore()
+    with pytest.raises(PolicyError, match="requires a signature verifier"):
+        store.load_policy(default_replacement())
+    with pytest.raises(PolicyError, match="cannot be unloaded"):
+        store.unload_policy(DEFAULT_POLICY["policy_id"])
+
+
+def test_default_policy_replacement_with_a_verifier():
+    rejecting = PolicyStore(verify_signature=lambda doc: False)
+    with pytest.raises(PolicyError, match="invalid signature"):
+        rejecting.load_policy(default_replacement())
+
+    store = PolicyStore(verify_signature=lambda doc: True)
+    with pytest.raises(PolicyError, match="drops required rules DEF-003"):
+        store.load_policy(default_replacement(rules=DEFAULT_POLICY["rules"][:2]))
+    extra = {"id": "DEF-004", "condition": "network_connections > 8", "action": "deny"}
+    snapshot = store.load_policy(default_replacement(rules=DEFAULT_POLICY["rules"] + [extra]))
+    assert snapshot.evaluate({"crypto_algorithm": 1, "network_connections": 9})["rule_id"] == "DEF-004"
+    with pytest.raises(PolicyError, match="cannot be unloaded"):
+        store.unload_policy(DEFAULT_POLICY["policy_id"])
+
+
+def test_in_flight_snapshot_is_pinned(make_policy):
+    store = PolicyStore()
+    pinned = store.snapshot
+    store.load_policy(make_policy("GOV-SEC-00000001", QUARANTINE_UPTIME))
+    state = {"crypto_algorithm": 1, "uptime": 9}
+    assert pinned.evaluate(state)["action"] == "allow"
+    assert store.evaluate(state)["action"] == "quarantine"
@@ -0,0 +1,64 @@
+import multiprocessing
+
+import pytest
+
+from policy_store import PolicyError, compile_policy
+from shared_policies import SharedPolicyStore
+
+QUARANTINE_UPTIME = [("uptime > 5", "quarantine")]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "policies")
+
+
+def _push(path, doc, results):
+    results.put(SharedPolicyStore(path).update(load=[doc]).version)
+
+
+def test_update_in_another_process_reaches_every_store(path, make_policy):
+    store = SharedPolicyStore(path)
+    pinned = store.snapshot
+    doc = make_policy("GOV-SEC-00000001", QUARANTINE_UPTIME)
+
+    results = multiprocessing.get_context("fork").Queue()
+    child = multiprocessing.get_context("fork").Process(target=_push, args=(path, doc, results))
+    child.start()
+    child.join()
+    assert results.get(timeout=5) == 1
+
+    assert store.snapshot.version == 1
+    assert store.evaluate({"uptime": 9})["action"] == "quarantine"
+    # A snapshot taken before the push keeps the old set
+    assert pinned.version == 0 and pinned.evaluate({"uptime": 9})["action"] == "allow"
+
+
+def test_versions_increase_across_stores(path, make_policy):
+    first, second = SharedPolicyStore(path), SharedPolicyStore(path)
+    first.load_policy(make_policy("GOV-SEC-00000001", QUARANTINE_UPTIME))
+    snapshot = second.load_policy(make_policy("GOV-SEC-00000002", QUARANTINE_UPTIME))
+    assert snapshot.version == 2
+    assert [p.policy_id for p in first.snapshot.policies] == [
+        "GOV-SEC-DEFAULT", "GOV-SEC-00000001", "GOV-SEC-00000002"]
+    # Migration checks see the shared set, not this store's stale copy
+    with pytest.raises(PolicyError, match="version must increase"):
+        second.load_policy(make_policy("GOV-SEC-00000001", QUARANTINE_UPTIME))
+
+
+def test_seed_only_when_nothing_is_published(path, make_policy):
+    seeded = [compile_policy(make_policy("GOV-SEC-00000001", QUARANTINE_UPTIME))]
+    assert SharedPolicyStore(path).seed(seeded).version == 1
+    late = [compile_policy(make_policy("GOV-SEC-00000002", QUARANTINE_UPTIME))]
+    store = SharedPolicyStore(path)
+    assert store.seed(late).version == 1
+    assert store.snapshot.get("GOV-SEC-00000002") is None
+
+
+def test_unreadable_set_keeps_the_last_good_one(path, make_policy):
+    store = SharedPolicyStore(path)
+    store.load_policy(make_policy("GOV-SEC-00000001", QUARANTINE_UPTIME))
+    with open(path, "wb") as f:
+        f.write(b"garbage")
+    assert store.snapshot.version == 1
+    assert store.evaluate({"uptime": 9})["action"] == "quarantine"
@@ -0,0 +1,45 @@
+import pytest
+
+import warm_state
+from warm_state import DEVICES, POLICIES, WarmState
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "warm")
+
+
+def test_round_trip(path):
+    warm_state.save(path, {POLICIES: b"policies", DEVICES: b""})
+    state = WarmState.open(path)
+    assert bytes(state.section(POLICIES)) == b"policies"
+    assert bytes(state.section(DEVICES)) == b""
+    assert state.section(b"NONE") is None
+
+
+def test_existing_mapping_survives_a_save(path):
+    warm_state.save(path, {POLICIES: b"old"})
+    state = WarmState.open(path)
+    warm_state.save(path, {POLICIES: b"new"})
+    assert bytes(state.section(POLICIES)) == b"old"
+    assert bytes(WarmState.open(path).section(POLICIES)) == b"new"
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: b"",
+    lambda data: data[:3],
+    lambda data: b"XXXX" + data[4:],
+    lambda data: data[:-1],
+    lambda data: data[:warm_state.HEADER.size + 4],
+])
+def test_damaged_snapshot_is_ignored(path, damage):
+    warm_state.save(path, {POLICIES: b"policies", DEVICES: b"devices"})
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(damage(data))
+    assert WarmState.open(path) is None
+
+
+def test_missing_snapshot(path):
+    assert WarmState.open(path) is None
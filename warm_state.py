@@ -0,0 +1,95 @@
+"""
+Warm-state snapshot for fast backend restarts
+One file of tagged sections (policy bundle, device registry records, ...)
+written atomically on shutdown and memory-mapped at boot. Sections come
+back as memoryviews over the mapping; nothing is decoded until a
+subsystem asks for its section on first use.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = b"NWS1"
+HEADER = struct.Struct("<4sH")
+SECTION = struct.Struct("<4sII")   # tag, offset, length
+
+POLICIES = b"POLS"   # policy_binary bundle
+DEVICES = b"DEVS"    # device_shards RECORD bytes
+
+
+class WarmStateError(ValueError):
+    pass
+
+
+def write_atomic(path, chunks):
+    """Write ``chunks`` to ``path`` via a temp file and os.replace. The
+    data and the rename are fsynced first, so after a crash or power loss
+    ``path`` holds either the old file or the complete new one, and
+    existing mappings of the old file stay valid."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".warm-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def save(path, sections):
+    """Write {tag: bytes} to ``path`` atomically (see write_atomic)."""
+    offset = HEADER.size + SECTION.size * len(sections)
+    index = bytearray()
+    for tag, data in sections.items():
+        index += SECTION.pack(tag, offset, len(data))
+        offset += len(data)
+    write_atomic(path, [HEADER.pack(MAGIC, len(sections)), index, *sections.values()])
+
+
+class WarmState:
+    """Read-only, memory-mapped view of a saved snapshot."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        self.sections = {}
+        try:
+            magic, count = HEADER.unpack_from(view, 0)
+            if magic != MAGIC:
+                raise WarmStateError(f"{path}: not a warm-state snapshot")
+            for i in range(count):
+                tag, offset, length = SECTION.unpack_from(view, HEADER.size + SECTION.size * i)
+                if offset + length > len(view):
+                    raise WarmStateError(f"{path}: truncated {tag!r} section")
+                self.sections[tag] = (offset, length)
+        except BaseException:
+            view.release()
+            self._mmap.close()
+            raise
+        self._view = view
+
+    @classmethod
+    def open(cls, path):
+        """Map ``path`` if a usable snapshot exists there, else return None."""
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def section(self, tag):
+        if tag not in self.sections:
+            return None
+        offset, length = self.sections[tag]
+        return self._view[offset:offset + length]